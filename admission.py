@@ -0,0 +1,174 @@
+from collections import Counter, deque
+from fastapi import HTTPException, status
+from config import get_int, get_float
+import asyncio
+import math
+import time
+
+
+class Ticket:
+    """Admitted work for one request; each job is released when it finishes."""
+
+    def __init__(self, backend, user_id, jobs: int):
+        self.backend = backend
+        self.user_id = user_id
+        self.remaining = jobs
+        self.waiting = jobs
+
+    async def run(self, func, *args, **kwargs):
+        return await self.run_batch(1, func, *args, **kwargs)
+
+    async def run_batch(self, jobs: int, func, *args, **kwargs):
+        """Run one call that does the work of ``jobs`` admitted jobs, once the backend has room for them."""
+        slots = await self.backend._acquire(jobs)
+        try:
+            self.waiting -= jobs
+            self.backend._start(jobs)
+            started = time.monotonic()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.backend._finish(time.monotonic() - started, jobs)
+                self._release(jobs)
+        finally:
+            self.backend._free(slots)
+
+    def cancel(self):
+        """Give back jobs that will never run; safe to call again, or after some jobs ran."""
+        waiting, self.waiting = self.waiting, 0
+        self.backend._unqueue(waiting)
+        self._release(waiting)
+
+    def _release(self, jobs: int):
+        if self.remaining <= 0:
+            return
+        self.remaining -= jobs
+        if self.remaining <= 0:
+            self.backend._release_user(self.user_id)
+
+
+class Backend:
+    """Admission control for one generation backend.
+
+    ``capacity`` jobs may run at once and ``max_queued`` more may wait; anything
+    beyond that, or beyond ``per_user`` concurrent requests for one user, is
+    rejected with 429 and a Retry-After estimated from measured job durations.
+    Admitted jobs wait in ``run_batch`` for free slots, first come first served.
+    """
+
+    def __init__(self, name: str, capacity: int, max_queued: int, per_user: int, default_job_seconds: float):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.max_queued = max_queued
+        self.per_user = per_user
+        self.in_flight = 0
+        self.queued = 0
+        self.avg_job_seconds = default_job_seconds
+        self.completed = 0
+        self._per_user = Counter()
+        self._slots_taken = 0
+        self._waiters = deque()
+
+    def admit(self, user_id=None, jobs: int = 1):
+        if user_id is not None and self.per_user and self._per_user[user_id] >= self.per_user:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                detail=f"You already have {self._per_user[user_id]} {self.name} jobs in progress",
+                                headers={"Retry-After": str(self.retry_after(jobs))})
+
+        if self.in_flight + self.queued + jobs > self.capacity + self.max_queued:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                detail=f"The {self.name} backend is busy, try again later",
+                                headers={"Retry-After": str(self.retry_after(jobs))})
+
+        self.queued += jobs
+        if user_id is not None:
+            self._per_user[user_id] += 1
+        return Ticket(self, user_id, jobs)
+
+    def retry_after(self, jobs: int = 1):
+        """Seconds until ``jobs`` more would fit, from the measured throughput."""
+        throughput = self.capacity / self.avg_job_seconds
+        excess = self.in_flight + self.queued + jobs - self.capacity - self.max_queued
+        return max(1, math.ceil(max(excess, 1) / throughput))
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "capacity": self.capacity,
+            "max_queued": self.max_queued,
+            "avg_job_seconds": round(self.avg_job_seconds, 2),
+            "completed": self.completed
+        }
+
+    async def _acquire(self, jobs: int):
+        """Wait until ``jobs`` slots are free and take them; returns the number taken."""
+        # A batch larger than the backend runs on its own rather than never
+        slots = min(jobs, self.capacity)
+        if not self._waiters and self._slots_taken + slots <= self.capacity:
+            self._slots_taken += slots
+            return slots
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((slots, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as we were cancelled: hand the slots on
+                self._free(slots)
+            else:
+                self._waiters.remove((slots, waiter))
+                self._wake()
+            raise
+        return slots
+
+    def _free(self, slots: int):
+        self._slots_taken -= slots
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._slots_taken + self._waiters[0][0] <= self.capacity:
+            slots, waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self._slots_taken += slots
+            waiter.set_result(None)
+
+    def _start(self, jobs: int = 1):
+        self.queued -= jobs
+        self.in_flight += jobs
+
+    def _finish(self, seconds: float, jobs: int = 1):
+        self.in_flight -= jobs
+        self.completed += jobs
+        # Exponentially weighted so the estimate follows the backend's current speed
+        self.avg_job_seconds = 0.8 * self.avg_job_seconds + 0.2 * max(seconds, 0.1)
+
+    def _unqueue(self, jobs: int):
+        self.queued -= jobs
+
+    def _release_user(self, user_id):
+        if user_id is None:
+            return
+        self._per_user[user_id] -= 1
+        if self._per_user[user_id] <= 0:
+            del self._per_user[user_id]
+
+
+tts = Backend(
+    "TTS",
+    capacity=get_int("TTS_MAX_CONCURRENT", 2),
+    max_queued=get_int("TTS_MAX_QUEUED", 30),
+    per_user=get_int("USER_MAX_CONCURRENT_UPLOADS", 2),
+    default_job_seconds=get_float("TTS_DEFAULT_JOB_SECONDS", 300)
+)
+
+voice_changer = Backend(
+    "voice changing",
+    capacity=get_int("VOICE_CHANGER_MAX_CONCURRENT", 2),
+    max_queued=get_int("VOICE_CHANGER_MAX_QUEUED", 30),
+    per_user=get_int("USER_MAX_CONCURRENT_CONVERSIONS", 3),
+    default_job_seconds=get_float("VOICE_CHANGER_DEFAULT_JOB_SECONDS", 120)
+)
@@ -0,0 +1,238 @@
+"""Generation state of audio artifacts.
+
+Every base narration and converted voice has at most one ``Artifact`` row,
+keyed by (owner kind, owner id, variant). Its state only moves along:
+
+    (none) -> Pending -> Processing -> Ready
+    Pending or Processing -> Failed -> Pending (a retry, attempts + 1)
+
+Pending means admitted and queued, Processing means the backend is working on
+it. Evicting a Ready voice deletes its row, so the next request starts over.
+A Pending or Processing claim older than ARTIFACT_CLAIM_TIMEOUT_SECONDS was
+left behind by a crash or restart and counts as Failed.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
+from database import SessionLocal
+from models import ArtifactState, ItemKind
+from storage import storage
+from config import get_float
+import audio_index
+import circuit
+import voices
+import models
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_CLAIM_TIMEOUT_SECONDS = get_float("ARTIFACT_CLAIM_TIMEOUT_SECONDS", 3600)
+ARTIFACT_REAP_INTERVAL_SECONDS = get_float("ARTIFACT_REAP_INTERVAL_SECONDS", 300)
+STALE = "Abandoned: no progress within the claim timeout"
+MYSQL_DEADLOCK = 1213
+
+TRANSITIONS = {
+    None: {ArtifactState.PENDING},
+    ArtifactState.PENDING: {ArtifactState.PROCESSING, ArtifactState.FAILED},
+    ArtifactState.PROCESSING: {ArtifactState.READY, ArtifactState.FAILED},
+    ArtifactState.FAILED: {ArtifactState.PENDING},
+    ArtifactState.READY: set(),
+}
+# Base narrations in the order they are generated: child, female, male
+BASE_GENDERS = {audio_index.base_variant(gender): gender for gender in (2, 1, 0)}
+BASE_VARIANTS = list(BASE_GENDERS)
+
+
+def lookup(dp, kind: ItemKind, owner_id: int, variant: str):
+    return dp.get(models.Artifact, (kind, owner_id, variant))
+
+
+def is_stale(artifact, now: datetime = None):
+    """True for a Pending or Processing claim nobody can still be working on."""
+    if artifact.state not in (ArtifactState.PENDING, ArtifactState.PROCESSING) or artifact.claimed_at is None:
+        return False
+    return (now or datetime.utcnow()) - artifact.claimed_at > timedelta(seconds=ARTIFACT_CLAIM_TIMEOUT_SECONDS)
+
+
+def in_progress(artifact):
+    """True while someone holds a live claim on the artifact."""
+    return artifact is not None and artifact.state in (ArtifactState.PENDING, ArtifactState.PROCESSING) \
+        and not is_stale(artifact)
+
+
+def base_states(dp, kind: ItemKind, owner_id: int):
+    """State of each base narration (child, female, male), None where it was never started."""
+    rows = dp.query(models.Artifact.variant, models.Artifact.state).filter(
+        models.Artifact.owner_kind == kind,
+        models.Artifact.owner_id == owner_id,
+        models.Artifact.variant.in_(BASE_VARIANTS)
+    ).all()
+    states = dict(rows)
+    return {variant: states.get(variant) for variant in BASE_VARIANTS}
+
+
+def voice_statuses(dp, kind: ItemKind, owner_id: int):
+    """Status of every voice for one item, from a single range scan of its artifact rows."""
+    rows = dp.query(models.Artifact.variant, models.Artifact.state, models.Artifact.audio,
+                    models.Artifact.audio_id).filter(
+        models.Artifact.owner_kind == kind,
+        models.Artifact.owner_id == owner_id,
+        models.Artifact.variant.like("voice:%")
+    ).all()
+    by_variant = {variant: (state, audio_id or audio) for variant, state, audio, audio_id in rows}
+
+    statuses = []
+    for voice in voices.registry.snapshot.voices.values():
+        state, audio = by_variant.get(audio_index.voice_variant(voice.id), (None, None))
+        if state == ArtifactState.READY:
+            label = "Ready"
+        elif state in (None, ArtifactState.FAILED):
+            # Requesting the voice starts (or retries) its conversion
+            label = "Missing"
+        elif circuit.voice_changer.is_open:
+            label = "Unavailable"
+        else:
+            label = "Processing"
+        statuses.append({
+            "voice_id": voice.id,
+            "name": voice.name,
+            "status": label,
+            "audio": audio if label == "Ready" else None
+        })
+    return statuses
+
+
+def is_deadlock(error: OperationalError):
+    return bool(getattr(error.orig, "args", None)) and error.orig.args[0] == MYSQL_DEADLOCK
+
+
+def advance(kind: ItemKind, owner_id: int, variant: str, state: ArtifactState, **fields):
+    """Move an artifact to ``state`` on the primary; False if the state machine does not allow it."""
+    dp = SessionLocal()
+    try:
+        if state == ArtifactState.PENDING:
+            # Create a missing row without a locking read: SELECT ... FOR UPDATE on
+            # an absent key takes a gap lock, and two first requests holding it
+            # deadlock on their INSERTs. Committing right away drops the shared
+            # lock a duplicate key leaves, before the row is locked below.
+            now = datetime.utcnow()
+            created = dp.connection().execute(
+                insert(models.Artifact).prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite"),
+                {"owner_kind": kind, "owner_id": owner_id, "variant": variant, "state": state, "attempts": 1,
+                 "claimed_at": now, "created_at": now, "updated_at": now, **fields}
+            ).rowcount
+            dp.commit()
+            if created:
+                return True
+
+        artifact = dp.query(models.Artifact).filter(
+            models.Artifact.owner_kind == kind,
+            models.Artifact.owner_id == owner_id,
+            models.Artifact.variant == variant
+        ).with_for_update().first()
+        now = datetime.utcnow()
+        current = artifact.state if artifact else None
+        if state == ArtifactState.PENDING and artifact is not None and is_stale(artifact, now):
+            logger.warning("Reclaiming abandoned %s %s %s", kind.value, owner_id, variant)
+            current = ArtifactState.FAILED
+        if state not in TRANSITIONS[current]:
+            return False
+
+        if artifact is None:
+            artifact = models.Artifact(owner_kind=kind, owner_id=owner_id, variant=variant,
+                                       attempts=1, created_at=now)
+            dp.add(artifact)
+        elif state == ArtifactState.PENDING:
+            artifact.attempts += 1
+            artifact.error = None
+        artifact.state = state
+        artifact.updated_at = now
+        if state in (ArtifactState.PENDING, ArtifactState.PROCESSING):
+            artifact.claimed_at = now
+        for name, value in fields.items():
+            setattr(artifact, name, value)
+        dp.commit()
+        return True
+    except IntegrityError:
+        # Another request created the row first
+        dp.rollback()
+        return False
+    except OperationalError as e:
+        if state != ArtifactState.PENDING or not is_deadlock(e):
+            raise
+        # Two claims raced for the same row; whoever MySQL rolled back lost it
+        dp.rollback()
+        return False
+    finally:
+        dp.close()
+
+
+def start(kind: ItemKind, owner_id: int, variant: str):
+    """Claim generation of a missing or failed artifact; False if someone else already has."""
+    return advance(kind, owner_id, variant, ArtifactState.PENDING)
+
+
+def ready(kind: ItemKind, owner_id: int, variant: str, audio: str, audio_id: str = None):
+    size = storage.size(audio) if storage.exists(audio) else None
+    return advance(kind, owner_id, variant, ArtifactState.READY, audio=audio, audio_id=audio_id,
+                   size_bytes=size, last_accessed_at=datetime.utcnow())
+
+
+def fail(kind: ItemKind, owner_id: int, variant: str, error: str):
+    try:
+        return advance(kind, owner_id, variant, ArtifactState.FAILED, error=str(error)[:500])
+    except SQLAlchemyError:
+        logger.exception("Could not record failure of %s %s %s", kind.value, owner_id, variant)
+        return False
+
+
+@contextmanager
+def tracking(kind: ItemKind, owner_id: int, variant: str):
+    """Mark a pending artifact as processing, and as failed if the block raises."""
+    advance(kind, owner_id, variant, ArtifactState.PROCESSING)
+    try:
+        yield
+    except HTTPException as e:
+        fail(kind, owner_id, variant, e.detail)
+        raise
+    except Exception as e:
+        fail(kind, owner_id, variant, e)
+        raise
+    except BaseException as e:
+        # Cancelled (e.g. shutdown): nobody will finish it, so let the next request retry
+        fail(kind, owner_id, variant, f"Interrupted: {type(e).__name__}")
+        raise
+
+
+def reap_stale():
+    """Fail every claim older than the timeout; returns how many were failed."""
+    now = datetime.utcnow()
+    dp = SessionLocal()
+    try:
+        count = dp.query(models.Artifact).filter(
+            models.Artifact.state.in_([ArtifactState.PENDING, ArtifactState.PROCESSING]),
+            models.Artifact.claimed_at < now - timedelta(seconds=ARTIFACT_CLAIM_TIMEOUT_SECONDS)
+        ).update({
+            models.Artifact.state: ArtifactState.FAILED,
+            models.Artifact.error: STALE,
+            models.Artifact.updated_at: now
+        }, synchronize_session=False)
+        dp.commit()
+        if count:
+            logger.warning("Failed %s abandoned artifacts", count)
+        return count
+    except SQLAlchemyError:
+        dp.rollback()
+        logger.exception("Reaping abandoned artifacts failed")
+        return 0
+    finally:
+        dp.close()
+
+
+async def run_reaper(interval: float = ARTIFACT_REAP_INTERVAL_SECONDS):
+    while True:
+        await asyncio.to_thread(reap_stale)
+        await asyncio.sleep(interval)
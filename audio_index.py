@@ -0,0 +1,211 @@
+from fastapi import HTTPException, Depends, APIRouter, status
+from typing import Annotated, Optional
+from datetime import datetime
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from database import SessionLocal
+from auth import get_read_db, get_optional_user_id
+from storage import storage
+from models import ItemKind
+import models
+import schemas
+import hashlib
+import logging
+import wave
+import os
+import re
+
+router = APIRouter(
+    prefix='/audio',
+    tags=['Audio']
+)
+
+logger = logging.getLogger(__name__)
+
+read_dp_dependency = Annotated[Session, Depends(get_read_db)]
+optional_user_dependency = Annotated[Optional[int], Depends(get_optional_user_id)]
+
+CHAPTER_HEADING = re.compile(r"^(chapter|part|prologue|epilogue|الفصل|الباب|الجزء|فصل)\b", re.IGNORECASE)
+GENDERS = {0: "male", 1: "female", 2: "child"}
+
+
+def base_variant(gender):
+    """Variant name of the TTS narration a voice is converted from."""
+    if isinstance(gender, int):
+        return f"base:{GENDERS[gender]}"
+    return {"Male": "base:male", "Female": "base:female"}.get(gender, "base:child")
+
+
+def voice_variant(voice_id: int):
+    return f"voice:{voice_id}"
+
+
+def probe(path: str):
+    """Size, checksum and, where the format allows, duration, bitrate and data offset."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    size = os.path.getsize(path)
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    info = {"format": extension, "size_bytes": size, "checksum": digest.hexdigest(),
+            "duration_ms": None, "bitrate": None, "data_offset": 0, "framerate": None, "block_align": None}
+
+    if extension == "wav":
+        with wave.open(path, "rb") as audio:
+            block_align = audio.getsampwidth() * audio.getnchannels()
+            info.update(
+                duration_ms=round(audio.getnframes() * 1000 / audio.getframerate()),
+                bitrate=audio.getframerate() * block_align * 8,
+                data_offset=size - audio.getnframes() * block_align,
+                framerate=audio.getframerate(),
+                block_align=block_align
+            )
+    else:
+        try:
+            from mutagen import File
+        except ImportError:
+            return info
+        audio = File(path)
+        if audio is not None and audio.info:
+            info.update(duration_ms=round(audio.info.length * 1000), bitrate=getattr(audio.info, "bitrate", None))
+    return info
+
+
+def chapters_from_segments(segments, info):
+    """Chapter table for a stitched WAV from its (sentence, start frame) pairs."""
+    chapters = []
+    for sentence, start_frame in segments:
+        if CHAPTER_HEADING.match(sentence) or not chapters:
+            chapters.append({
+                "title": sentence[:100] if CHAPTER_HEADING.match(sentence) else "Start",
+                "start_ms": round(start_frame * 1000 / info["framerate"]),
+                "start_byte": info["data_offset"] + start_frame * info["block_align"]
+            })
+    return chapters
+
+
+def chapters_from_base(base_chapters, info):
+    """Carry a narration's chapter times over to a converted voice of the same length.
+
+    Byte offsets are derived from the average bitrate, so they are exact for
+    WAV and constant-bitrate MP3 only; in a VBR file ``start_byte`` is an
+    estimate and players should seek by ``start_ms``.
+    """
+    if not info["bitrate"]:
+        return []
+    return [
+        {
+            "title": chapter["title"],
+            "start_ms": chapter["start_ms"],
+            "start_byte": min(info["size_bytes"] - 1,
+                              info["data_offset"] + chapter["start_ms"] * info["bitrate"] // 8000)
+        }
+        for chapter in base_chapters
+    ]
+
+
+def index_audio(kind: ItemKind, item_id: int, variant: str, key: str, segments=None, base: str = None):
+    """Compute and store metadata for a freshly written artifact."""
+    if not storage.exists(key):
+        return None
+
+    dp = SessionLocal()
+    try:
+        info = probe(storage.fetch(key))
+        chapters = []
+        if segments and info["framerate"]:
+            chapters = chapters_from_segments(segments, info)
+        elif base:
+            base_metadata = dp.get(models.AudioMetadata, (kind, item_id, base))
+            if base_metadata:
+                chapters = chapters_from_base(base_metadata.chapters, info)
+
+        metadata = models.AudioMetadata(
+            item_kind=kind,
+            item_id=item_id,
+            variant=variant,
+            audio=key,
+            format=info["format"],
+            duration_ms=info["duration_ms"],
+            bitrate=info["bitrate"],
+            size_bytes=info["size_bytes"],
+            checksum=info["checksum"],
+            chapters=chapters,
+            created_at=datetime.utcnow()
+        )
+        dp.merge(metadata)
+        dp.commit()
+        return metadata
+    except (SQLAlchemyError, wave.Error, EOFError, OSError):
+        dp.rollback()
+        logger.exception("Could not index %s", key)
+        return None
+    finally:
+        dp.close()
+
+
+def get_metadata(dp: Session, kind: ItemKind, item_id: int, voice_id: int, user_id: Optional[int]):
+    if kind == ItemKind.UPLOAD:
+        # Uploads are private to their owner; someone else's reads as missing
+        if user_id is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user.")
+        owned = dp.query(models.Upload.id).filter(
+            models.Upload.id == item_id,
+            models.Upload.user_id == user_id
+        ).first()
+        if not owned:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    metadata = dp.get(models.AudioMetadata, (kind, item_id, voice_variant(voice_id)))
+    if not metadata:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Audio not indexed yet")
+    return metadata
+
+
+@router.get("/metadata/{kind}/{item_id}/{voice_id}", response_model=schemas.AudioInfo)
+async def get_audio_metadata(kind: ItemKind, item_id: int, voice_id: int, dp: read_dp_dependency,
+                             user_id: optional_user_dependency):
+    try:
+        metadata = get_metadata(dp, kind, item_id, voice_id, user_id)
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+
+    return {
+        "format": metadata.format,
+        "duration_ms": metadata.duration_ms,
+        "bitrate": metadata.bitrate,
+        "size_bytes": metadata.size_bytes,
+        "checksum": metadata.checksum,
+        "chapters": metadata.chapters
+    }
+
+
+@router.get("/seek/{kind}/{item_id}/{voice_id}/{chapter}", response_model=schemas.ChapterRange)
+async def seek_to_chapter(kind: ItemKind, item_id: int, voice_id: int, chapter: int, dp: read_dp_dependency,
+                          user_id: optional_user_dependency):
+    try:
+        metadata = get_metadata(dp, kind, item_id, voice_id, user_id)
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+
+    chapters = metadata.chapters
+    if not 0 <= chapter < len(chapters):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chapter not found")
+
+    start = chapters[chapter]
+    if chapter + 1 < len(chapters):
+        end_byte = chapters[chapter + 1]["start_byte"] - 1
+        end_ms = chapters[chapter + 1]["start_ms"]
+    else:
+        end_byte = metadata.size_bytes - 1
+        end_ms = metadata.duration_ms
+
+    return {
+        "chapter": chapter,
+        "title": start["title"],
+        "start_ms": start["start_ms"],
+        "end_ms": end_ms,
+        "start_byte": start["start_byte"],
+        "end_byte": end_byte,
+        "range": f"bytes={start['start_byte']}-{end_byte}"
+    }
@@ -1,15 +1,16 @@
 from datetime import timedelta, datetime, timezone
 from passlib.context import CryptContext
 import models
-from dotenv import dotenv_values
+from config import config_credentials
 from fastapi import HTTPException, status,Depends, APIRouter, Request
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
-from database import SessionLocal
-from typing import Annotated
+from database import SessionLocal, ReadSessionLocal
+from typing import Annotated, Optional
 from sqlalchemy.orm import Session
 import jwt
 import emails
+import schemas
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordRequestForm
@@ -19,10 +20,9 @@ router = APIRouter(
     tags=['Auth']
 )
 
-config_credentials = dotenv_values(".env")
-
 bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl='auth/token')
+optional_oauth2_bearer = OAuth2PasswordBearer(tokenUrl='auth/token', auto_error=False)
 templates = Jinja2Templates(directory="Templates")
 
 
@@ -120,6 +120,52 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)], dp: dp
                             detail="Could not validate user.")
 
 
+async def get_current_user_id(token: Annotated[str, Depends(oauth2_bearer)]):
+    """Validate the token without a database lookup, for high-frequency endpoints."""
+    try:
+        payload = jwt.decode(token, config_credentials["SECRET"], algorithms=config_credentials["ALGORITHM"])
+        user_id = payload.get("id")
+    except jwt.PyJWTError:
+        user_id = None
+
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Could not validate user.")
+    return user_id
+
+
+async def get_optional_user_id(token: Annotated[Optional[str], Depends(optional_oauth2_bearer)]):
+    """Like get_current_user_id, but None without a valid token, for endpoints that are partly public."""
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, config_credentials["SECRET"], algorithms=config_credentials["ALGORITHM"])
+    except jwt.PyJWTError:
+        return None
+    return payload.get("id")
+
+
+def get_read_db(token: Annotated[Optional[str], Depends(optional_oauth2_bearer)]):
+    """Session for read-only endpoints.
+
+    Goes to a replica unless the caller wrote recently, in which case it stays
+    on the primary so the caller reads their own writes.
+    """
+    user_id = None
+    if token:
+        try:
+            payload = jwt.decode(token, config_credentials["SECRET"], algorithms=config_credentials["ALGORITHM"])
+            user_id = payload.get("id")
+        except jwt.PyJWTError:
+            pass
+
+    db = ReadSessionLocal(user_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
 class UserBase(BaseModel):
     username: str
     email: str
@@ -127,7 +173,7 @@ class UserBase(BaseModel):
     birthdate: str
 
 
-@router.post("/register/", status_code=status.HTTP_201_CREATED)
+@router.post("/register/", response_model=schemas.Message, status_code=status.HTTP_201_CREATED)
 async def register(user_data: UserBase, dp: dp_dependency):
     user = models.User(
         username=user_data.username,
@@ -140,22 +186,18 @@ async def register(user_data: UserBase, dp: dp_dependency):
     if temp_user:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An account already exists with this email.")
 
+    # The verification email is committed to the outbox together with the user
+    # and delivered by the background sender, so SMTP never blocks registration.
     try:
         dp.add(user)
+        dp.flush()
+        emails.enqueue_verification_email(dp, user)
         dp.commit()
     except Exception as e:
         dp.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
-    user = dp.query(models.User).filter(user.email==models.User.email).first()
-
-    # Send verification email
-    try:
-        await emails.send_email([user.email], user)
-    except Exception as e:
-        dp.delete(user)
-        dp.commit()
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    emails.outbox_sender.wake()
 
     return {"message": "User registered successfully. Please check your email to verify your account."}
 
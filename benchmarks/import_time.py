@@ -0,0 +1,28 @@
+"""Import-time benchmark for the application module.
+
+Runs ``import main`` in a fresh interpreter several times and fails with a
+non-zero exit code when the best time exceeds the budget, so it can gate CI:
+
+    python benchmarks/import_time.py [budget_seconds]
+"""
+import subprocess
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPEAT = 5
+DEFAULT_BUDGET = 1.5
+
+CODE = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def measure():
+    result = subprocess.run([sys.executable, "-c", CODE], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET
+    best = min(measure() for _ in range(REPEAT))
+    print(f"import main: {best * 1000:.1f} ms (budget {budget * 1000:.0f} ms)")
+    sys.exit(0 if best <= budget else 1)
@@ -0,0 +1,56 @@
+"""Statement count of the batch library endpoints against an in-memory SQLite copy of the schema.
+
+Adding or removing N books one at a time costs about 3N statements; the batch
+helpers must stay at a constant number of statements whatever N is. Exits
+non-zero if they do not.
+
+    python benchmarks/library_batch.py
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+import models
+import book
+
+BATCH_SIZES = [1, 10, 100, 500]
+USER_ID = 1
+
+
+def main():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    dp = Session()
+    dp.add(models.User(id=USER_ID, username="reader", email="reader@example.com", password="x"))
+    dp.add_all(models.Book(id=book_id, title=f"Book {book_id}") for book_id in range(1, max(BATCH_SIZES) + 1))
+    dp.commit()
+
+    failed = False
+    print(f"{'books':>6} {'add':>5} {'re-add':>7} {'remove':>7}")
+    for size in BATCH_SIZES:
+        # Half of the IDs do not exist, to exercise the per-ID results
+        book_ids = list(range(1, size + 1)) + [10_000 + i for i in range(size)]
+        counts = []
+        for operation in (book.add_books_to_library, book.add_books_to_library, book.remove_books_from_library):
+            statements.clear()
+            operation(dp, USER_ID, book_ids)
+            dp.commit()
+            counts.append(len(statements))
+        print(f"{size:>6} {counts[0]:>5} {counts[1]:>7} {counts[2]:>7}")
+        failed |= any(count > 3 for count in counts)
+
+    if failed:
+        print("A batch operation issued more than 3 statements")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Load test for the progress write-behind buffer with 10k simulated listeners.
+
+Each listener sends a heartbeat every HEARTBEAT_SECONDS of simulated time and
+the buffer is flushed every FLUSH_SECONDS, so the output shows how many
+heartbeats collapse into each bulk upsert. The writer only counts rows unless
+``--db`` is given, in which case the real MySQL upsert is used.
+
+    python benchmarks/progress_load.py [--db]
+"""
+import asyncio
+import random
+import sys
+import time
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import progress
+from models import ItemKind
+
+LISTENERS = 10_000
+SIMULATED_SECONDS = 60
+HEARTBEAT_SECONDS = 1
+FLUSH_SECONDS = 5
+
+batches = []
+
+
+def counting_writer(rows):
+    batches.append(len(rows))
+
+
+async def main(use_db: bool):
+    buffer = progress.ProgressBuffer(writer=progress.write_progress_batch if use_db else counting_writer)
+    listeners = [(user_id, random.choice(list(ItemKind)), random.randint(1, 500), random.randint(1, 10))
+                 for user_id in range(1, LISTENERS + 1)]
+
+    started = time.perf_counter()
+    record_seconds = 0.0
+    for second in range(SIMULATED_SECONDS):
+        t = time.perf_counter()
+        for user_id, kind, item_id, voice_id in listeners:
+            if (user_id + second) % HEARTBEAT_SECONDS == 0:
+                buffer.record(user_id, kind, item_id, voice_id, second * 1000)
+        record_seconds += time.perf_counter() - t
+        if second % FLUSH_SECONDS == FLUSH_SECONDS - 1:
+            await buffer.flush()
+    await buffer.flush()
+    elapsed = time.perf_counter() - started
+
+    print(f"listeners:            {LISTENERS}")
+    print(f"heartbeats:           {buffer.heartbeats}")
+    print(f"rows written:         {buffer.rows_written} in {len(batches) or 'n/a'} batches")
+    print(f"coalescing ratio:     {buffer.heartbeats / max(buffer.rows_written, 1):.1f} heartbeats per row")
+    print(f"record throughput:    {buffer.heartbeats / record_seconds:,.0f} heartbeats/s")
+    print(f"total wall time:      {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main("--db" in sys.argv))
@@ -0,0 +1,54 @@
+"""Microbenchmark: serialization cost of a 10k-item book list.
+
+Compares the old ORM object -> dict -> jsonable_encoder -> json path with
+the row tuple -> ORJSONResponse path used by the list endpoints.
+
+    python benchmarks/serialization.py
+"""
+from collections import namedtuple
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+import timeit
+
+ITEMS = 10_000
+REPEAT = 5
+
+Row = namedtuple("Row", ["id", "title", "author", "publish_year", "category", "cover_photo"])
+
+
+class FakeBook:
+    def __init__(self, i):
+        self.id = i
+        self.title = f"Book {i}"
+        self.author = f"Author {i % 500}"
+        self.publish_year = 1900 + i % 120
+        self.category = "Fiction"
+        self.cover_photo = f"Data\\covers\\{i}.jpg"
+
+
+books = [FakeBook(i) for i in range(ITEMS)]
+rows = [Row(b.id, b.title, b.author, b.publish_year, b.category, b.cover_photo) for b in books]
+
+
+def orm_dict_encoder():
+    book_info_list = []
+    for book in books:
+        book_info_list.append({
+            "id": book.id,
+            "title": book.title,
+            "author": book.author,
+            "publish_year": book.publish_year,
+            "category": book.category,
+            "cover_photo": book.cover_photo
+        })
+    return JSONResponse(jsonable_encoder(book_info_list)).body
+
+
+def row_orjson():
+    return ORJSONResponse([row._asdict() for row in rows]).body
+
+
+if __name__ == "__main__":
+    for name, fn in [("orm -> dict -> encoder -> json", orm_dict_encoder), ("rows -> orjson", row_orjson)]:
+        best = min(timeit.repeat(fn, number=1, repeat=REPEAT))
+        print(f"{name:34s} {best * 1000:8.2f} ms per {ITEMS} items")
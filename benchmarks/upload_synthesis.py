@@ -0,0 +1,90 @@
+"""Time to narrate one upload in three genders against a local TTS stub.
+
+Compares the three ways ``upload.py`` has asked for narrations:
+
+* sequential: one request per gender, one after another (before batching)
+* concurrent: one request per gender, all in flight at once
+* batched: a single request for all genders (``TTS_BATCH_URL``)
+
+The stub listens where the English TTS service does (127.0.0.3:8000). Every
+request spends PREPROCESS_SECONDS reading and normalizing the text, which runs
+in parallel across requests, then SYNTHESIS_SECONDS per gender on a single
+synthesis worker shared by all requests. Absolute numbers only reflect those
+two settings; the ratio between the modes is what to look at.
+
+    python benchmarks/upload_synthesis.py
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import threading
+import asyncio
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+import upload
+
+HOST, PORT = "127.0.0.3", 8000
+BATCH_URL = f"http://{HOST}:{PORT}/TTS/batch"
+PREPROCESS_SECONDS = 0.4
+SYNTHESIS_SECONDS = 0.2
+ROUNDS = 3
+GENDERS = [1, 0, 2]
+
+synthesis_worker = threading.Lock()
+
+
+class StubTTS(BaseHTTPRequestHandler):
+    def do_POST(self):
+        params = parse_qs(urlparse(self.path).query)
+        genders = params["genders"][0].split(",") if "genders" in params else params["gender"]
+        time.sleep(PREPROCESS_SECONDS)
+        for _ in genders:
+            with synthesis_worker:
+                time.sleep(SYNTHESIS_SECONDS)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+async def sequential(book):
+    for gender in GENDERS:
+        await upload.send_tts_request(book, f"out_{gender}.wav", gender, "book.txt")
+
+
+async def concurrent(book):
+    await asyncio.gather(*(upload.send_tts_request(book, f"out_{gender}.wav", gender, "book.txt")
+                           for gender in GENDERS))
+
+
+async def batched(book):
+    await upload.send_tts_batch_request(book, BATCH_URL, [f"out_{gender}.wav" for gender in GENDERS], GENDERS,
+                                        "book.txt")
+
+
+async def main():
+    book = models.Upload(id=1, user_id=1, language=models.Language.ENGLISH, text="book.pdf")
+    print(f"{'mode':>10} {'seconds':>8}")
+    for name, narrate in (("sequential", sequential), ("concurrent", concurrent), ("batched", batched)):
+        timings = []
+        for _ in range(ROUNDS):
+            started = time.perf_counter()
+            await narrate(book)
+            timings.append(time.perf_counter() - started)
+        print(f"{name:>10} {min(timings):>8.2f}")
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer((HOST, PORT), StubTTS)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        asyncio.run(main())
+    finally:
+        server.shutdown()
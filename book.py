@@ -1,12 +1,26 @@
-from fastapi import HTTPException, Depends, APIRouter, status, BackgroundTasks
-from typing import Annotated
+from fastapi import HTTPException, Depends, APIRouter, status, BackgroundTasks, Request
+from typing import Annotated, List
 import models
-from database import SessionLocal
+from database import SessionLocal, replicas
 from sqlalchemy.orm import Session
-from auth import get_current_user
+from auth import get_current_user, get_read_db
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import insert, select
+from config import get_int
 import httpx
 import os
+import caching
+import schemas
+import admission
+import circuit
+from storage import storage, artifact_key
+from eviction import evictor
+import popularity
+import audio_index
+import voices
+import artifacts
+from models import ArtifactState, ItemKind
+import asyncio
 
 
 router = APIRouter(
@@ -14,6 +28,8 @@ router = APIRouter(
     tags=['Book']
 )
 
+MAX_LIBRARY_BATCH = get_int("MAX_LIBRARY_BATCH", 500)
+
 
 def get_db():
     db = SessionLocal()
@@ -24,33 +40,35 @@ def get_db():
 
 
 dp_dependency = Annotated[Session, Depends(get_db)]
+read_dp_dependency = Annotated[Session, Depends(get_read_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
 
-@router.get("/get_all_books/")
-async def get_all_books(dp: dp_dependency):
+@router.get("/get_all_books/", response_model=List[schemas.BookSummary])
+async def get_all_books(dp: read_dp_dependency, request: Request):
     try:
-        books = dp.query(models.Book).all()
-        book_info_list = []
-        for book in books:
-            book_info = {
-                "id": book.id,
-                "title": book.title,
-                "author": book.author,
-                "publish_year": book.publish_year,
-                "category": book.category,
-                "cover_photo": book.cover_photo
-            }
-            book_info_list.append(book_info)
-
-        return book_info_list
+        etag = caching.make_etag("books", caching.table_version(dp, models.Book.updated_at))
+        cached = caching.not_modified(request, etag)
+        if cached:
+            return cached
+
+        books = dp.query(
+            models.Book.id,
+            models.Book.title,
+            models.Book.author,
+            models.Book.publish_year,
+            models.Book.category,
+            models.Book.cover_photo
+        ).all()
+
+        return schemas.rows_response(books, headers={"ETag": etag})
 
     except SQLAlchemyError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
 
 
-@router.get("/get_book_details/{book_id}", response_model=dict)
-async def get_book_details(dp: dp_dependency, user: user_dependency, book_id: int):
+@router.get("/get_book_details/{book_id}", response_model=schemas.BookDetails)
+async def get_book_details(dp: read_dp_dependency, user: user_dependency, book_id: int):
     try:
         book = dp.query(models.Book).filter(models.Book.id == book_id).first()
 
@@ -84,7 +102,7 @@ async def get_book_details(dp: dp_dependency, user: user_dependency, book_id: in
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
 
 
-@router.post("/add_to_my_books/{book_id}")
+@router.post("/add_to_my_books/{book_id}", response_model=schemas.Message)
 async def add_to_my_books(book_id: int, dp: dp_dependency, user: user_dependency):
     try:
         # Retrieve the specific book by book_id
@@ -107,37 +125,125 @@ async def add_to_my_books(book_id: int, dp: dp_dependency, user: user_dependency
         user_book = models.UserBook(user_id=user["id"], book_id=book_id)
         dp.add(user_book)
         dp.commit()
+        replicas.mark_write(user["id"])
 
         return {"message": "The book added to your collection successfully"}
     except SQLAlchemyError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
 
 
-@router.get("/get_my_books", response_model=list)
-async def get_my_books(dp: dp_dependency, user: user_dependency):
+def add_books_to_library(dp: Session, user_id: int, book_ids: List[int]):
+    """Add many books at once: two SELECTs and one INSERT IGNORE, however many IDs."""
+    book_ids = list(dict.fromkeys(book_ids))
+    existing = {book_id for (book_id,) in dp.query(models.Book.id).filter(models.Book.id.in_(book_ids))}
+    owned = {book_id for (book_id,) in dp.query(models.UserBook.book_id).filter(
+        models.UserBook.user_id == user_id,
+        models.UserBook.book_id.in_(book_ids)
+    )}
+    new = [book_id for book_id in book_ids if book_id in existing and book_id not in owned]
+    if new:
+        # Ignoring duplicates on the (user_id, book_id) key makes concurrent adds harmless.
+        # The SQLite prefix is only for tests/test_library_batch.py and benchmarks/library_batch.py
+        dp.execute(
+            insert(models.UserBook).prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite"),
+            [{"user_id": user_id, "book_id": book_id} for book_id in new]
+        )
+
+    results = []
+    for book_id in book_ids:
+        if book_id not in existing:
+            result = "not_found"
+        elif book_id in owned:
+            result = "already_added"
+        else:
+            result = "added"
+        results.append({"book_id": book_id, "status": result})
+    return results
+
+
+def remove_books_from_library(dp: Session, user_id: int, book_ids: List[int]):
+    """Remove many books at once: one SELECT and one DELETE, however many IDs."""
+    book_ids = list(dict.fromkeys(book_ids))
+    owned = {book_id for (book_id,) in dp.query(models.UserBook.book_id).filter(
+        models.UserBook.user_id == user_id,
+        models.UserBook.book_id.in_(book_ids)
+    )}
+    if owned:
+        dp.query(models.UserBook).filter(
+            models.UserBook.user_id == user_id,
+            models.UserBook.book_id.in_(owned)
+        ).delete(synchronize_session=False)
+
+    return [{"book_id": book_id, "status": "removed" if book_id in owned else "not_in_library"}
+            for book_id in book_ids]
+
+
+def check_batch(body: schemas.BookIds):
+    if not body.book_ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No books given")
+    if len(body.book_ids) > MAX_LIBRARY_BATCH:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {MAX_LIBRARY_BATCH} books per request")
+
+
+@router.post("/batch_add_to_my_books", response_model=List[schemas.LibraryResult])
+async def batch_add_to_my_books(body: schemas.BookIds, dp: dp_dependency, user: user_dependency):
+    check_batch(body)
+    try:
+        results = add_books_to_library(dp, user["id"], body.book_ids)
+        dp.commit()
+        replicas.mark_write(user["id"])
+        return results
+    except SQLAlchemyError as e:
+        dp.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+
+
+@router.post("/batch_remove_from_my_books", response_model=List[schemas.LibraryResult])
+async def batch_remove_from_my_books(body: schemas.BookIds, dp: dp_dependency, user: user_dependency):
+    check_batch(body)
+    try:
+        results = remove_books_from_library(dp, user["id"], body.book_ids)
+        dp.commit()
+        replicas.mark_write(user["id"])
+        return results
+    except SQLAlchemyError as e:
+        dp.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+
+
+@router.get("/get_my_books", response_model=List[schemas.MyBook])
+async def get_my_books(dp: read_dp_dependency, user: user_dependency, request: Request):
     try:
+        etag = caching.make_etag(
+            "my_books", user["id"],
+            caching.table_version(dp, models.UserBook.created_at, models.UserBook.user_id == user["id"]),
+            # Only this user's books: an edit elsewhere in the catalog keeps the ETag
+            caching.table_version(dp, models.Book.updated_at, models.Book.id.in_(
+                select(models.UserBook.book_id).where(models.UserBook.user_id == user["id"])
+            ))
+        )
+        cached = caching.not_modified(request, etag)
+        if cached:
+            return cached
+
         # Query the database to retrieve books where my_books is True
-        user_books = dp.query(models.UserBook).filter(models.UserBook.user_id == user["id"]).all()
-
-        # Construct a list of dictionaries with the desired information
-        my_books_info_list = []
-        for user_book in user_books:
-            book = dp.query(models.Book).filter(models.Book.id == user_book.book_id).first()
-            book_info = {
-                "id": book.id,
-                "title": book.title,
-                "author": book.author,
-                "text": book.text,
-                "cover_photo": book.cover_photo
-            }
-            my_books_info_list.append(book_info)
-
-        return my_books_info_list
+        my_books = dp.query(
+            models.Book.id,
+            models.Book.title,
+            models.Book.author,
+            models.Book.text,
+            models.Book.cover_photo
+        ).join(
+            models.UserBook, models.UserBook.book_id == models.Book.id
+        ).filter(models.UserBook.user_id == user["id"]).all()
+
+        return schemas.rows_response(my_books, headers={"ETag": etag})
     except SQLAlchemyError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
 
 
-@router.post("/remove_from_my_books/{book_id}")
+@router.post("/remove_from_my_books/{book_id}", response_model=schemas.Message)
 async def remove_from_my_books(book_id: int, dp: dp_dependency, user: user_dependency):
     try:
         user_book = dp.query(models.UserBook).filter(
@@ -150,6 +256,7 @@ async def remove_from_my_books(book_id: int, dp: dp_dependency, user: user_depen
 
         dp.delete(user_book)
         dp.commit()
+        replicas.mark_write(user["id"])
 
         return {"message": "Book removed Successfully"}
     except SQLAlchemyError as e:
@@ -157,116 +264,133 @@ async def remove_from_my_books(book_id: int, dp: dp_dependency, user: user_depen
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
 
 
-@router.get("/get_book_voice/")
+@router.get("/get_book_voice/", response_model=schemas.VoiceAudio, response_model_exclude_none=True)
 async def get_book_voice(book_id: int, voice_id: int, dp: dp_dependency, background_tasks: BackgroundTasks ):
+    if voices.registry.get(voice_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Voice not found")
+
+    variant = audio_index.voice_variant(voice_id)
     try:
+        # Reads the primary: the answer decides whether to start a conversion
+        # Polling resolves with this one primary-key lookup until the voice is ready
+        artifact = artifacts.lookup(dp, ItemKind.BOOK, book_id, variant)
+        # Only counted once the ids are known to be real
+        if artifact:
+            popularity.counter.record_request(book_id, voice_id)
+
+        if artifact and artifact.state == ArtifactState.READY:
+            evictor.touch("book", book_id, voice_id)
+            popularity.counter.record_play(book_id, voice_id)
+            popularity.scheduler.record_ready(book_id, voice_id)
+            return {"audio": artifact.audio, "url": await asyncio.to_thread(storage.url, artifact.audio)}
+
+        if artifacts.in_progress(artifact):
+            if circuit.voice_changer.is_open:
+                return {"message": circuit.UNAVAILABLE_MESSAGE}
+            return {"message": "Processing"}
+
         book = dp.query(models.Book).filter(
             models.Book.id == book_id
         ).first()
-
-
-        if not os.path.exists(book.child_audio):
-            try:
-                background_tasks.add_task(send_tts_request, book, book.child_audio, 2)
-            except Exception as e:
-                dp.rollback()
-                return {"message": "Error"}
-            return {"message": "Can't get this audio now, try again in an hour"}
-
-        if not os.path.exists(book.female_audio):
-            try:
-                background_tasks.add_task(send_tts_request, book, book.female_audio, 1)
-            except Exception as e:
-                dp.rollback()
-                return {"message": "Error"}
-            return {"message": "Can't get this audio now, try again in an hour"}
-
-        if not os.path.exists(book.male_audio):
-            try:
-                background_tasks.add_task(send_tts_request, book, book.male_audio, 0)
-            except Exception as e:
-                dp.rollback()
-                return {"message": "Error"}
+        if not book:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
+        if not artifact:
+            popularity.counter.record_request(book_id, voice_id)
+
+        # Conversion needs all three base narrations; start the first missing one
+        for base, base_state in artifacts.base_states(dp, ItemKind.BOOK, book_id).items():
+            if base_state == ArtifactState.READY:
+                continue
+            if circuit.tts_for(book.language).is_open:
+                return {"message": circuit.UNAVAILABLE_MESSAGE}
+            if base_state in (None, ArtifactState.FAILED):
+                gender = artifacts.BASE_GENDERS[base]
+                output_key = (book.male_audio, book.female_audio, book.child_audio)[gender]
+                ticket = admission.tts.admit()
+                if artifacts.start(ItemKind.BOOK, book_id, base):
+                    background_tasks.add_task(ticket.run, send_tts_request, book, output_key, gender)
+                else:
+                    ticket.cancel()
             return {"message": "Can't get this audio now, try again in an hour"}
 
-        book_voice_status = dp.query(models.BookVoiceStatus).filter(
-            (models.BookVoiceStatus.book_id == book_id),
-            (models.BookVoiceStatus.voice_id == voice_id)
-        ).first()
-
-        if not book_voice_status:
-            book = dp.query(models.Book).filter(
-                models.Book.id == book_id
-            ).first()
-
-            voice = dp.query(models.Voice).filter(
-                models.Voice.id == voice_id
-            ).first()
+        if circuit.voice_changer.is_open:
+            return {"message": circuit.UNAVAILABLE_MESSAGE}
 
-            # processing
-            path = os.path.join(r"D:\Backend\New folder", book.title, f"{voice.name}.mp3")
+        out_key = artifact_key("book", book_id, f"voice_{voice_id}.mp3")
+        ticket = admission.voice_changer.admit()
+        if not artifacts.start(ItemKind.BOOK, book_id, variant):
+            ticket.cancel()
+            return {"message": "Processing"}
 
-            await generate_book_voice(book_id, voice_id, path, dp)
+        popularity.scheduler.record_on_demand(book_id, voice_id)
+        await ticket.run(generate_book_voice, book_id, voice_id, out_key, dp)
 
-            return {"message": "Processing"}
+        return {"message": "Processing"}
 
-        if not book_voice_status.status:
-            return {"message": "Processing"}
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
 
-        book_voice = dp.query(models.BookVoice).filter(
-            models.BookVoice.book_id == book_id,
-            models.BookVoice.voice_id == voice_id
-        ).first()
 
-        return {"audio": book_voice.audio}
+@router.get("/get_book_voices_status/{book_id}", response_model=List[schemas.VoiceStatus])
+async def get_book_voices_status(book_id: int, dp: read_dp_dependency):
+    try:
+        if not dp.query(models.Book.id).filter(models.Book.id == book_id).first():
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
 
+        # Read-only: never triggers generation
+        return artifacts.voice_statuses(dp, ItemKind.BOOK, book_id)
     except SQLAlchemyError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
 
 
-async def generate_book_voice(book_id: int, voice_id: int, out_path: str, dp: dp_dependency):
+async def generate_book_voice(book_id: int, voice_id: int, out_key: str, dp: dp_dependency):
+    with artifacts.tracking(ItemKind.BOOK, book_id, audio_index.voice_variant(voice_id)):
+        await convert_book_voice(book_id, voice_id, out_key, dp)
+
+
+async def convert_book_voice(book_id: int, voice_id: int, out_key: str, dp: dp_dependency):
     try:
 
         book = dp.query(models.Book).filter(
             models.Book.id == book_id
         ).first()
 
-        voice = dp.query(models.Voice).filter(
-            models.Voice.id == voice_id
-        ).first()
-
-        configs = dp.query(models.VoicesConfigs).filter(
-            (models.VoicesConfigs.voice_id == voice_id)
-        ).first()
+        voice = voices.registry.get(voice_id)
+        if voice is None or voice.model_name is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Voice not found")
 
         audio = {
             "Male": book.male_audio,
             "Female": book.female_audio
         }.get(voice.gender, book.child_audio)
-        audio = os.path.join(r"C:\Users\K.M\StudioProjects\Prototype", audio)
+        audio = await asyncio.to_thread(storage.fetch, audio)
+        out_path = storage.path_for(out_key)
         data = {
             "input_path": audio,
             "output_path": out_path,
-            "transpose": configs.transpose,
-            "model_name": configs.model_name,
+            "transpose": voice.transpose,
+            "model_name": voice.model_name,
             "upload_id": book_id,
             "voice_id": voice_id,
             "is_book": True
         }
-        print(audio)
-
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "http://127.0.0.2:8000/voice_changing/", params=data,
-                timeout=300
-            )
-            response.raise_for_status()
 
-        print(response)
+        await circuit.post(circuit.voice_changer, "http://127.0.0.2:8000/voice_changing/", data)
+        if not os.path.exists(out_path):
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY,
+                                detail="Voice changing service produced no audio")
+        await asyncio.to_thread(storage.commit, out_key)
+        artifacts.ready(ItemKind.BOOK, book_id, audio_index.voice_variant(voice_id), out_key)
+        await asyncio.to_thread(audio_index.index_audio, models.ItemKind.BOOK, book_id,
+                                audio_index.voice_variant(voice_id), out_key,
+                                base=audio_index.base_variant(voice.gender))
 
     except SQLAlchemyError as e:
         dp.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+    except circuit.CircuitOpenError as e:
+        dp.rollback()
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
     except httpx.HTTPStatusError as e:
         dp.rollback()
         raise HTTPException(status_code=e.response.status_code,
@@ -281,13 +405,21 @@ async def generate_book_voice(book_id: int, voice_id: int, out_path: str, dp: dp
                             detail="Voice changing service request timed out")
 
 
-async def send_tts_request(book: models.Book, output_path: str, gender: int):
+async def send_tts_request(book: models.Book, output_key: str, gender: int):
+    with artifacts.tracking(ItemKind.BOOK, book.id, audio_index.base_variant(gender)):
+        return await synthesize_base(book, output_key, gender)
+
+
+async def synthesize_base(book: models.Book, output_key: str, gender: int):
+    output_path = storage.path_for(output_key)
+    # With S3 storage committed files leave the spool, so bring the text back first
+    txt_path = await asyncio.to_thread(storage.fetch, book.text)
     url = ""
     data = {}
     if book.language == models.Language.ENGLISH:
         url = "http://127.0.0.3:8000/TTS/"
         data = {
-            "txt_path": book.text,
+            "txt_path": txt_path,
             "output_path": output_path,
             "gender": gender
         }
@@ -297,19 +429,22 @@ async def send_tts_request(book: models.Book, output_path: str, gender: int):
             diacritics = False
         url = "http://127.0.0.4:8000/TTSArabic/"
         data = {
-            "txt_path": book.text,
+            "txt_path": txt_path,
             "output_path": output_path,
             "gender": gender,
             "diacritics": diacritics
         }
 
     try:
-
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, params=data, timeout=300)
-        response.raise_for_status()
+        response = await circuit.post(circuit.tts_for(book.language), url, data)
+        await asyncio.to_thread(storage.commit, output_key)
+        artifacts.ready(ItemKind.BOOK, book.id, audio_index.base_variant(gender), output_key)
+        await asyncio.to_thread(audio_index.index_audio, models.ItemKind.BOOK, book.id,
+                                audio_index.base_variant(gender), output_key)
         return response
 
+    except circuit.CircuitOpenError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
     except httpx.HTTPStatusError as e:
         raise HTTPException(status_code=e.response.status_code, detail=f"TTS service error: {e.response.text}")
     except httpx.RequestError as e:
@@ -0,0 +1,82 @@
+from fastapi import Request, Response
+from starlette.datastructures import MutableHeaders
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+import hashlib
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MINIMUM_SIZE = 1024
+# Already compressed (or not worth compressing); also never compressed: 206 responses
+INCOMPRESSIBLE_TYPES = ("application/zip", "application/octet-stream", "audio/", "image/", "video/")
+
+
+def table_version(dp: Session, column, *criteria):
+    """Cheap version stamp for a table (or the rows matching ``criteria``): row count and newest change.
+
+    ``column`` is the table's indexed updated-at (or created-at) column, stored
+    with microsecond precision, so every insert or edit moves the maximum and
+    every delete changes the count.
+    """
+    count, latest = dp.query(func.count(), func.max(column)).select_from(column.class_).filter(*criteria).one()
+    return f"{count}:{latest.isoformat() if latest else ''}"
+
+
+def make_etag(*parts):
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def not_modified(request: Request, etag: str):
+    """Return a 304 response if the client already holds ``etag``, otherwise None."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+
+class IdentityMarker:
+    """Keeps binary and partial responses out of the compression middleware.
+
+    Installed on both sides of it: the inner one labels such responses
+    ``Content-Encoding: identity`` so the compressor passes them through, the
+    outer one removes the label again before the response leaves the app.
+    """
+
+    def __init__(self, app, strip: bool = False):
+        self.app = app
+        self.strip = strip
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_marked(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if self.strip:
+                    if headers.get("content-encoding") == "identity":
+                        del headers["content-encoding"]
+                elif "content-encoding" not in headers and (
+                        message["status"] == 206 or
+                        headers.get("content-type", "").startswith(INCOMPRESSIBLE_TYPES)):
+                    headers["content-encoding"] = "identity"
+            await send(message)
+
+        await self.app(scope, receive, send_marked)
+
+
+def add_compression(app):
+    """Compress large responses, preferring brotli when brotli-asgi is installed."""
+    app.add_middleware(IdentityMarker)
+    try:
+        from brotli_asgi import BrotliMiddleware
+    except ImportError:
+        from starlette.middleware.gzip import GZipMiddleware
+        app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+    else:
+        # Falls back to gzip on its own for clients without brotli support
+        app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+    app.add_middleware(IdentityMarker, strip=True)
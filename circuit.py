@@ -0,0 +1,190 @@
+from enum import Enum as PyEnum
+from config import get_int, get_float
+import logging
+import asyncio
+import random
+import time
+import httpx
+import models
+
+logger = logging.getLogger(__name__)
+
+UNAVAILABLE_MESSAGE = "Backend unavailable, try again later"
+
+
+class BreakerState(PyEnum):
+    CLOSED = "Closed"
+    OPEN = "Open"
+    HALF_OPEN = "Half-open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, breaker):
+        super().__init__(f"{breaker.name} is unavailable")
+        self.breaker = breaker
+
+
+def is_retryable(error: Exception):
+    """Connection problems, timeouts and 5xx answers count against the backend; 4xx do not."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.RequestError)
+
+
+def may_retry(error: Exception, idempotent: bool):
+    """Whether a failed call may be sent again.
+
+    A non-idempotent job (a TTS or conversion POST) that timed out or got a 5xx
+    may still be running downstream, so it is only resent when it never
+    reached the service.
+    """
+    if idempotent:
+        return is_retryable(error)
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker with a retry budget for one downstream service.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and calls
+    fail immediately for ``reset_timeout`` seconds, then a single trial call is
+    let through (half-open). Retries are paid from a token bucket that every
+    call refills by ``retry_ratio``, so retries can never multiply load during
+    an outage.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 60.0,
+                 max_attempts: int = 3, base_backoff: float = 1.0, max_backoff: float = 30.0,
+                 retry_ratio: float = 0.2, max_retry_tokens: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.retry_ratio = retry_ratio
+        self.max_retry_tokens = max_retry_tokens
+        self.retry_tokens = max_retry_tokens
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._trial_in_progress = False
+
+    @property
+    def is_open(self):
+        """True while calls would be rejected without being attempted."""
+        if self.state == BreakerState.OPEN:
+            return time.monotonic() - self.opened_at < self.reset_timeout
+        return self.state == BreakerState.HALF_OPEN and self._trial_in_progress
+
+    def _allow(self):
+        if self.state == BreakerState.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = BreakerState.HALF_OPEN
+            logger.info("Circuit %s half-open", self.name)
+
+        if self.state == BreakerState.HALF_OPEN:
+            if self._trial_in_progress:
+                return False
+            self._trial_in_progress = True
+        return True
+
+    def _record_success(self):
+        if self.state != BreakerState.CLOSED:
+            logger.info("Circuit %s closed", self.name)
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self._trial_in_progress = False
+
+    def _record_failure(self, error: Exception):
+        self.failures += 1
+        self.last_error = str(error)[:200]
+        self._trial_in_progress = False
+        if self.state == BreakerState.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != BreakerState.OPEN:
+                logger.error("Circuit %s opened after %s failures: %s", self.name, self.failures, error)
+            self.state = BreakerState.OPEN
+            self.opened_at = time.monotonic()
+
+    def _withdraw_retry(self):
+        if self.retry_tokens >= 1:
+            self.retry_tokens -= 1
+            return True
+        return False
+
+    def _backoff(self, attempt: int):
+        # Full jitter
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+
+    async def call(self, func, *args, idempotent: bool = True, **kwargs):
+        self.retry_tokens = min(self.max_retry_tokens, self.retry_tokens + self.retry_ratio)
+
+        for attempt in range(self.max_attempts):
+            if not self._allow():
+                raise CircuitOpenError(self)
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    self._trial_in_progress = False
+                    raise
+                self._record_failure(e)
+                logger.warning("%s call failed (attempt %s/%s): %s", self.name, attempt + 1, self.max_attempts, e)
+                if (attempt + 1 >= self.max_attempts or self.state == BreakerState.OPEN
+                        or not may_retry(e, idempotent) or not self._withdraw_retry()):
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+            except BaseException:
+                # Cancelled mid-call: neither a success nor a failure, but a
+                # half-open trial must not stay claimed forever
+                self._trial_in_progress = False
+                raise
+            else:
+                self._record_success()
+                return result
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "state": (BreakerState.OPEN if self.is_open else self.state).value,
+            "failures": self.failures,
+            "retry_tokens": round(self.retry_tokens, 2),
+            "last_error": self.last_error
+        }
+
+
+def _breaker(name: str, prefix: str):
+    return CircuitBreaker(
+        name,
+        failure_threshold=get_int(f"{prefix}_BREAKER_FAILURES", 3),
+        reset_timeout=get_float(f"{prefix}_BREAKER_RESET_SECONDS", 60),
+        max_attempts=get_int(f"{prefix}_MAX_ATTEMPTS", 3)
+    )
+
+
+tts_english = _breaker("English TTS service", "TTS")
+tts_arabic = _breaker("Arabic TTS service", "TTS_ARABIC")
+voice_changer = _breaker("Voice changing service", "VOICE_CHANGER")
+
+breakers = [tts_english, tts_arabic, voice_changer]
+
+
+def tts_for(language):
+    return tts_english if language == models.Language.ENGLISH else tts_arabic
+
+
+async def post(breaker: CircuitBreaker, url: str, params: dict, timeout: float = 300, idempotent: bool = False):
+    """POST to a downstream service through ``breaker``, raising for error statuses.
+
+    Generation jobs are not idempotent and can run for minutes, so by default a
+    timed-out or failed POST is not resent (see ``may_retry``).
+    """
+    async def send():
+        async with httpx.AsyncClient() as client:
+            response = await client.post(url, params=params, timeout=timeout)
+        response.raise_for_status()
+        return response
+
+    return await breaker.call(send, idempotent=idempotent)
@@ -0,0 +1,32 @@
+from dotenv import dotenv_values
+import os
+
+# Loaded once per process and shared by every module; environment variables
+# override values from .env.
+config_credentials = {**dotenv_values(".env"), **{k: v for k, v in os.environ.items() if k.isupper()}}
+
+
+def get_str(key: str, default: str = None):
+    return config_credentials.get(key, default)
+
+
+def get_int(key: str, default: int):
+    value = config_credentials.get(key)
+    return int(value) if value not in (None, "") else default
+
+
+def get_float(key: str, default: float):
+    value = config_credentials.get(key)
+    return float(value) if value not in (None, "") else default
+
+
+def get_bool(key: str, default: bool):
+    value = config_credentials.get(key)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def get_list(key: str):
+    value = config_credentials.get(key) or ""
+    return [item.strip() for item in value.split(",") if item.strip()]
@@ -0,0 +1,14 @@
+"""Create any missing tables. Run once per deploy instead of on every import:
+
+    python migrate_schema.py
+    python create_db.py
+
+New columns on tables that already exist are added by ``migrate_schema.py``.
+"""
+import models
+from database import engine
+
+
+if __name__ == "__main__":
+    models.Base.metadata.create_all(bind=engine)
+    print("Tables created")
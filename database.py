@@ -1,14 +1,111 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from dotenv import dotenv_values
-
-config_credentials = dotenv_values(".env")
+from sqlalchemy.exc import SQLAlchemyError
+from config import config_credentials, get_list, get_float
+import itertools
+import threading
+import logging
+import asyncio
+import time
 
 URL_DATABASE = config_credentials["DATABASE_URL"]
 
-engine = create_engine(URL_DATABASE)
+engine = create_engine(URL_DATABASE, pool_pre_ping=True)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaRouter:
+    """Picks an engine for read-only sessions.
+
+    Reads are spread round-robin over healthy replicas. A user who wrote within
+    the last ``sticky_seconds`` reads from the primary so they see their own
+    changes, and replicas that fail a health check or lag more than
+    ``max_lag_seconds`` are taken out of rotation until they recover.
+    """
+
+    def __init__(self, primary, replicas, max_lag_seconds: float = 5.0, sticky_seconds: float = 10.0):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.healthy = list(replicas)
+        self.lag = {}
+        self.max_lag_seconds = max_lag_seconds
+        self.sticky_seconds = sticky_seconds
+        self._counter = itertools.count()
+        self._last_write = {}
+        self._lock = threading.Lock()
+
+    def mark_write(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            self._last_write[user_id] = now
+            if len(self._last_write) > 10000:
+                cutoff = now - self.sticky_seconds
+                self._last_write = {k: v for k, v in self._last_write.items() if v >= cutoff}
+
+    def engine_for_read(self, user_id=None):
+        if user_id is not None:
+            last_write = self._last_write.get(user_id)
+            if last_write is not None and time.monotonic() - last_write < self.sticky_seconds:
+                return self.primary
+
+        healthy = self.healthy
+        if not healthy:
+            return self.primary
+        return healthy[next(self._counter) % len(healthy)]
+
+    @staticmethod
+    def _replication_lag(connection):
+        for statement in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):
+            try:
+                row = connection.execute(text(statement)).mappings().first()
+            except SQLAlchemyError:
+                continue
+            if row is None:
+                return None
+            lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+            return float("inf") if lag is None else float(lag)
+        return None
+
+    def check_health(self):
+        healthy = []
+        for replica in self.replicas:
+            try:
+                with replica.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                    lag = self._replication_lag(connection)
+            except SQLAlchemyError as e:
+                self.lag[replica.url.host] = None
+                logger.warning("Replica %s is unreachable: %s", replica.url.host, e)
+                continue
+
+            self.lag[replica.url.host] = lag
+            if lag is not None and lag > self.max_lag_seconds:
+                logger.warning("Replica %s is %ss behind, out of rotation", replica.url.host, lag)
+                continue
+            healthy.append(replica)
+
+        self.healthy = healthy
+        return healthy
+
+    async def monitor(self, interval: float = 5.0):
+        while True:
+            await asyncio.to_thread(self.check_health)
+            await asyncio.sleep(interval)
+
+
+replicas = ReplicaRouter(
+    engine,
+    [create_engine(url, pool_pre_ping=True) for url in get_list("DATABASE_REPLICA_URLS")],
+    max_lag_seconds=get_float("REPLICA_MAX_LAG_SECONDS", 5.0),
+    sticky_seconds=get_float("REPLICA_STICKY_SECONDS", 10.0)
+)
+
+
+def ReadSessionLocal(user_id=None):
+    return SessionLocal(bind=replicas.engine_for_read(user_id))
@@ -0,0 +1,286 @@
+from fastapi import HTTPException, Depends, APIRouter, Request, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+from collections import Counter, OrderedDict
+from typing import Annotated, NamedTuple
+from urllib.parse import quote
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from auth import get_current_user_id, get_read_db
+from config import get_int
+from storage import storage
+from models import ArtifactState, ItemKind
+import models
+import artifacts
+import audio_index
+import caching
+import asyncio
+import threading
+import struct
+import zlib
+import os
+import re
+
+router = APIRouter(
+    prefix='/downloads',
+    tags=['Downloads']
+)
+
+read_dp_dependency = Annotated[Session, Depends(get_read_db)]
+user_id_dependency = Annotated[int, Depends(get_current_user_id)]
+
+DOWNLOADS_PER_USER = get_int("DOWNLOADS_PER_USER", 2)
+DOWNLOAD_RETRY_AFTER_SECONDS = get_int("DOWNLOAD_RETRY_AFTER_SECONDS", 30)
+CRC_CACHE_ENTRIES = get_int("DOWNLOAD_CRC_CACHE_ENTRIES", 4096)
+
+# Every entry is stored uncompressed, with the CRC in a trailing data descriptor
+# (flag bit 3) and a UTF-8 name (bit 11). Timestamps are fixed at 1980-01-01 so
+# the same files always produce the same bytes and a Range request can resume.
+ZIP_FLAGS = 0x0808
+ZIP_VERSION = 20
+DOS_TIME, DOS_DATE = 0, (1 << 5) | 1
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+DATA_DESCRIPTOR = struct.Struct("<IIII")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<IHHHHIIH")
+ZIP_LIMIT = 0xFFFFFFFF
+
+
+class Entry(NamedTuple):
+    name: str
+    key: str
+    size: int
+    # Changes when the bytes under ``key`` are regenerated; content-addressed keys need none
+    version: str = ""
+
+
+class Part(NamedTuple):
+    offset: int
+    length: int
+    kind: str
+    value: object
+
+
+class DownloadLimiter:
+    """Caps how many archives one user can stream at once."""
+
+    def __init__(self, per_user: int):
+        self.per_user = per_user
+        self._active = Counter()
+        self._lock = threading.Lock()
+
+    def acquire(self, user_id: int):
+        with self._lock:
+            if self._active[user_id] >= self.per_user:
+                raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                    detail=f"You already have {self._active[user_id]} downloads in progress",
+                                    headers={"Retry-After": str(DOWNLOAD_RETRY_AFTER_SECONDS)})
+            self._active[user_id] += 1
+
+    def release(self, user_id: int):
+        with self._lock:
+            self._active[user_id] -= 1
+            if self._active[user_id] <= 0:
+                del self._active[user_id]
+
+
+class ArchiveResponse(StreamingResponse):
+    """Streams an archive and runs ``on_close`` however the response ends.
+
+    A generator's finally only runs once iteration starts, which a client that
+    disconnects before the response headers are sent never gets to.
+    """
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+limiter = DownloadLimiter(DOWNLOADS_PER_USER)
+_crcs = OrderedDict()
+
+
+def crc_of(entry: Entry):
+    """CRC-32 of an entry's bytes; read from storage only when not already known."""
+    cache_key = (entry.key, entry.size, entry.version)
+    if cache_key in _crcs:
+        _crcs.move_to_end(cache_key)
+        return _crcs[cache_key]
+    crc = 0
+    for chunk in storage.open(entry.key):
+        crc = zlib.crc32(chunk, crc)
+    remember_crc(entry, crc)
+    return crc
+
+
+def remember_crc(entry: Entry, crc: int):
+    _crcs[(entry.key, entry.size, entry.version)] = crc
+    while len(_crcs) > CRC_CACHE_ENTRIES:
+        _crcs.popitem(last=False)
+
+
+def local_header(entry: Entry):
+    name = entry.name.encode()
+    return LOCAL_HEADER.pack(0x04034b50, ZIP_VERSION, ZIP_FLAGS, 0, DOS_TIME, DOS_DATE,
+                             0, entry.size, entry.size, len(name), 0) + name
+
+
+def central_directory(entries, offsets):
+    records = []
+    for entry, offset in zip(entries, offsets):
+        name = entry.name.encode()
+        records.append(CENTRAL_HEADER.pack(0x02014b50, ZIP_VERSION, ZIP_VERSION, ZIP_FLAGS, 0, DOS_TIME, DOS_DATE,
+                                           crc_of(entry), entry.size, entry.size, len(name), 0, 0, 0, 0, 0,
+                                           offset) + name)
+    return b"".join(records)
+
+
+def layout(entries):
+    """Byte layout of the archive; every size is known before a single byte is read."""
+    parts, offsets, position = [], [], 0
+
+    def add(length: int, kind: str, value):
+        nonlocal position
+        parts.append(Part(position, length, kind, value))
+        position += length
+
+    for entry in entries:
+        offsets.append(position)
+        header = local_header(entry)
+        add(len(header), "bytes", header)
+        add(entry.size, "data", entry)
+        add(DATA_DESCRIPTOR.size, "descriptor", entry)
+
+    directory_offset = position
+    directory_size = sum(CENTRAL_HEADER.size + len(entry.name.encode()) for entry in entries)
+    add(directory_size, "directory", offsets)
+    end = END_RECORD.pack(0x06054b50, 0, 0, len(entries), len(entries), directory_size, directory_offset, 0)
+    add(len(end), "bytes", end)
+
+    if position > ZIP_LIMIT or len(entries) > 0xFFFF:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail="Download is too large for a single archive")
+    return parts, position
+
+
+def stream_archive(entries, parts, start: int, end: int):
+    """Yield archive bytes ``start`` up to and excluding ``end``, a chunk at a time."""
+    for part in parts:
+        if part.offset + part.length <= start or part.offset >= end:
+            continue
+        lo = max(start, part.offset) - part.offset
+        hi = min(end, part.offset + part.length) - part.offset
+
+        if part.kind == "data":
+            entry = part.value
+            whole = lo == 0 and hi == part.length
+            crc = 0
+            for chunk in storage.open(entry.key, lo, hi):
+                if whole:
+                    crc = zlib.crc32(chunk, crc)
+                yield chunk
+            if whole:
+                remember_crc(entry, crc)
+            continue
+
+        if part.kind == "descriptor":
+            entry = part.value
+            data = DATA_DESCRIPTOR.pack(0x08074b50, crc_of(entry), entry.size, entry.size)
+        elif part.kind == "directory":
+            data = central_directory(entries, part.value)
+        else:
+            data = part.value
+        yield data[lo:hi]
+
+
+def parse_range(header: str, total: int):
+    """(start, end) for a single ``bytes=`` range, None to send everything."""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(0, total - int(last)), total
+    else:
+        start = int(first)
+        end = min(total, int(last) + 1) if last else total
+    if start >= total or start >= end:
+        raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                            detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{total}"})
+    return start, end
+
+
+def safe_name(title: str, fallback: str):
+    name = re.sub(r"[^\w\- .]+", "", title or "", flags=re.UNICODE).strip(" .")
+    return name[:80] or fallback
+
+
+def content_disposition(filename: str, fallback: str):
+    """Attachment header with an ASCII ``filename`` and the full name as RFC 5987 ``filename*``.
+
+    Header values are latin-1, so a non-ASCII name can only travel percent-encoded.
+    """
+    ascii_name = safe_name(filename.encode("ascii", "ignore").decode(), fallback)
+    return f"attachment; filename=\"{ascii_name}.zip\"; filename*=UTF-8''{quote(filename + '.zip')}"
+
+
+def bundle_entries(folder: str, audio: str, audio_size: int, audio_version: str, text: str, cover: str):
+    """Audio, text and cover of one item, in a fixed order; missing text or cover is skipped."""
+    entries = [Entry(f"{folder}/audio{os.path.splitext(audio)[1]}", audio, audio_size, audio_version)]
+    for name, key in (("text", text), ("cover", cover)):
+        if key and storage.exists(key):
+            entries.append(Entry(f"{folder}/{name}{os.path.splitext(key)[1]}", key, storage.size(key)))
+    return entries
+
+
+@router.get("/{kind}/{item_id}/{voice_id}")
+async def download_bundle(kind: ItemKind, item_id: int, voice_id: int, dp: read_dp_dependency,
+                          user_id: user_id_dependency, request: Request):
+    try:
+        model = models.Book if kind == ItemKind.BOOK else models.Upload
+        item = dp.query(model).filter(model.id == item_id).first()
+        if not item or (kind == ItemKind.UPLOAD and item.user_id != user_id):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{kind.value} not found")
+
+        artifact = artifacts.lookup(dp, kind, item_id, audio_index.voice_variant(voice_id))
+        if not artifact or artifact.state != ArtifactState.READY:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="This voice is not ready yet, request it first")
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+
+    fallback = f"{kind.value.lower()}-{item_id}"
+    folder = safe_name(item.title, fallback)
+    # A voice regenerated under the same key is Ready again with a new updated_at
+    entries = await asyncio.to_thread(
+        bundle_entries, folder, artifact.audio, artifact.size_bytes or storage.size(artifact.audio),
+        artifact.updated_at.isoformat(), item.text, item.cover_photo
+    )
+    parts, total = layout(entries)
+
+    etag = caching.make_etag("download", *(part for entry in entries for part in entry))
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": content_disposition(folder, fallback)
+    }
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range == etag:
+        byte_range = parse_range(request.headers.get("range"), total)
+    start, end = byte_range or (0, total)
+    headers["Content-Length"] = str(end - start)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{total}"
+
+    limiter.acquire(user_id)
+    return ArchiveResponse(iterate_in_threadpool(stream_archive(entries, parts, start, end)),
+                           lambda: limiter.release(user_id), media_type="application/zip", headers=headers,
+                           status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK)
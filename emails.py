@@ -1,58 +1,226 @@
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from dotenv import dotenv_values
-from typing import List
+from email.message import EmailMessage
+from datetime import datetime, timedelta
+from config import config_credentials, get_str, get_int, get_bool
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from database import SessionLocal
 from models import User
+import models
+import aiosmtplib
+import asyncio
+import logging
+import random
+import time
 import jwt
 
-config_credentials = dotenv_values(".env")
-
-config = ConnectionConfig(
-    MAIL_USERNAME=config_credentials["EMAIL"],
-    MAIL_PASSWORD=config_credentials["PASS"],
-    MAIL_FROM=config_credentials["EMAIL"],
-    MAIL_PORT=465,
-    MAIL_SERVER="smtp.gmail.com",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True
+MAIL_USERNAME = config_credentials["EMAIL"]
+MAIL_PASSWORD = config_credentials["PASS"]
+MAIL_FROM = config_credentials["EMAIL"]
+# Overridable so the sender can be pointed at a local SMTP stand-in (e.g. aiosmtpd)
+MAIL_SERVER = get_str("MAIL_SERVER", "smtp.gmail.com")
+MAIL_PORT = get_int("MAIL_PORT", 465)
+MAIL_SSL_TLS = get_bool("MAIL_SSL_TLS", True)
+USE_CREDENTIALS = get_bool("MAIL_USE_CREDENTIALS", True)
+
+logger = logging.getLogger(__name__)
+
+# Templates are compiled once and kept in the environment's cache
+template_env = Environment(
+    loader=FileSystemLoader("Templates"),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False
 )
 
 
-async def send_email(email: List, instance: User):
+def render_verification_email(instance: User):
     token_data = {
         "id": instance.id,
         "email": instance.email
     }
     token = jwt.encode(token_data, config_credentials["SECRET"], algorithm="HS256")
-    email_template = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Email Confirmation</title>
-    </head>
-    <body>
-        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-            <h1 style="text-align: center; color: #007bff;">Confirm Your Email Address</h1>
-            <p>Dear {instance.username},</p>
-            <p>Thank you for registering with ShahraZad! To complete your registration and confirm your email address, please click on the following link:</p>
-            <p><a href="http://localhost:8000/auth/verification?token={token}" style="display: block; width: fit-content; margin: 20px auto; padding: 10px 20px; background-color: #007bff; color: #fff; text-decoration: none;">Confirm Email</a></p>
-            <p>Please note that this link will expire in [Expiration Time], so be sure to complete the confirmation process as soon as possible.</p>
-            <p>If you did not register with ShahraZad, please disregard this email.</p>
-            <p>Thank you,<br>ShahraZad Team</p>
-        </div>
-    </body>
-    </html>
-    """
+    template = template_env.get_template("verification_email.html")
+    return template.render(username=instance.username, token=token)
+
 
-    message = MessageSchema(
-        subject="ShahraZad Account Verification",
-        recipients=email,  # Provide a list of email addresses
-        body=email_template,
-        subtype=MessageType.html
+def enqueue_email(dp: Session, recipient: str, subject: str, body: str):
+    """Add an email to the outbox; it is delivered once the caller's transaction commits."""
+    now = datetime.utcnow()
+    email = models.EmailOutbox(
+        recipient=recipient,
+        subject=subject,
+        body=body,
+        status=models.EmailStatus.PENDING,
+        attempts=0,
+        next_attempt_at=now,
+        created_at=now
     )
+    dp.add(email)
+    return email
+
+
+def enqueue_verification_email(dp: Session, instance: User):
+    return enqueue_email(dp, instance.email, "ShahraZad Account Verification",
+                         render_verification_email(instance))
+
+
+class OutboxSender:
+    """Delivers pending outbox rows in batches over one reused SMTP connection.
+
+    Failed sends are retried with jittered exponential backoff until
+    ``max_attempts`` is reached, and sends are spaced to ``rate_per_second``.
+    Rows are claimed for ``claim_seconds`` before sending, so several workers
+    can run a sender without delivering the same email twice.
+    """
+
+    def __init__(self, batch_size: int = 20, poll_interval: float = 2.0, rate_per_second: float = 5.0,
+                 max_attempts: int = 5, base_backoff: float = 30.0, max_backoff: float = 3600.0,
+                 claim_seconds: float = 300.0):
+        self.batch_size = batch_size
+        self.claim_seconds = claim_seconds
+        self.poll_interval = poll_interval
+        self.min_send_interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._smtp = None
+        self._last_send = 0.0
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+
+    def wake(self):
+        """Skip the current poll wait, e.g. right after an email was enqueued."""
+        self._wakeup.set()
+
+    async def _connection(self):
+        if self._smtp is not None and self._smtp.is_connected:
+            try:
+                await self._smtp.noop()
+                return self._smtp
+            except aiosmtplib.SMTPException:
+                await self._close()
+
+        smtp = aiosmtplib.SMTP(hostname=MAIL_SERVER, port=MAIL_PORT, use_tls=MAIL_SSL_TLS)
+        await smtp.connect()
+        if USE_CREDENTIALS:
+            await smtp.login(MAIL_USERNAME, MAIL_PASSWORD)
+        self._smtp = smtp
+        return smtp
+
+    async def _close(self):
+        if self._smtp is not None:
+            try:
+                await self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    async def _throttle(self):
+        wait = self._last_send + self.min_send_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_send = time.monotonic()
+
+    def _backoff(self, attempts: int):
+        delay = min(self.max_backoff, self.base_backoff * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _claim(self):
+        """Lease one batch of due rows; returns (id, recipient, subject, body, attempts) tuples."""
+        dp = SessionLocal()
+        try:
+            # Every worker runs a sender: lock the due rows, skipping any another
+            # worker holds, and lease them by pushing next_attempt_at forward.
+            # A worker that dies mid-batch leaves rows that become due again.
+            now = datetime.utcnow()
+            emails = dp.query(models.EmailOutbox).filter(
+                models.EmailOutbox.status == models.EmailStatus.PENDING,
+                models.EmailOutbox.next_attempt_at <= now
+            ).order_by(models.EmailOutbox.id).limit(self.batch_size).with_for_update(skip_locked=True).all()
+            claimed = []
+            for email in emails:
+                email.next_attempt_at = now + timedelta(seconds=self.claim_seconds)
+                claimed.append((email.id, email.recipient, email.subject, email.body, email.attempts))
+            dp.commit()
+            return claimed
+        except SQLAlchemyError:
+            dp.rollback()
+            raise
+        finally:
+            dp.close()
+
+    def _record(self, email_id: int, attempts: int, error: Exception = None):
+        """Store the outcome of one send attempt."""
+        values = {models.EmailOutbox.attempts: attempts}
+        if error is None:
+            values.update({models.EmailOutbox.status: models.EmailStatus.SENT,
+                           models.EmailOutbox.sent_at: datetime.utcnow()})
+        else:
+            values[models.EmailOutbox.last_error] = str(error)[:500]
+            if attempts >= self.max_attempts:
+                values[models.EmailOutbox.status] = models.EmailStatus.FAILED
+            else:
+                values[models.EmailOutbox.next_attempt_at] = datetime.utcnow() + timedelta(
+                    seconds=self._backoff(attempts))
+
+        dp = SessionLocal()
+        try:
+            dp.query(models.EmailOutbox).filter(models.EmailOutbox.id == email_id).update(
+                values, synchronize_session=False)
+            dp.commit()
+        except SQLAlchemyError:
+            dp.rollback()
+            raise
+        finally:
+            dp.close()
+
+    async def send_pending(self):
+        """Send one batch of due emails and return how many were processed."""
+        try:
+            # Database work runs in threads so the event loop keeps serving requests
+            emails = await asyncio.to_thread(self._claim)
+            for email_id, recipient, subject, body, attempts in emails:
+                message = EmailMessage()
+                message["From"] = MAIL_FROM
+                message["To"] = recipient
+                message["Subject"] = subject
+                message.set_content(body, subtype="html")
+
+                await self._throttle()
+                error = None
+                try:
+                    smtp = await self._connection()
+                    await smtp.send_message(message)
+                except (aiosmtplib.SMTPException, OSError) as e:
+                    await self._close()
+                    error = e
+                    if attempts + 1 >= self.max_attempts:
+                        logger.error("Giving up on email %s to %s: %s", email_id, recipient, e)
+                await asyncio.to_thread(self._record, email_id, attempts + 1, error)
+
+            return len(emails)
+        except SQLAlchemyError:
+            logger.exception("Email outbox query failed")
+            return 0
+
+    async def run(self):
+        while not self._stopping.is_set():
+            processed = await self.send_pending()
+            if processed >= self.batch_size:
+                continue
+            if processed == 0:
+                # Nothing left to send, don't hold the SMTP connection open while idle
+                await self._close()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+        await self._close()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
 
-    fn = FastMail(config)
-    await fn.send_message(message)
\ No newline at end of file
+outbox_sender = OutboxSender()
@@ -0,0 +1,113 @@
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from database import SessionLocal
+from storage import storage
+from config import get_int, get_float
+import models
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+VOICE_AUDIO_BUDGET_BYTES = get_int("VOICE_AUDIO_BUDGET_BYTES", 50 * 1024 ** 3)
+EVICTION_INTERVAL_SECONDS = get_float("EVICTION_INTERVAL_SECONDS", 300)
+
+ITEM_KINDS = {"book": models.ItemKind.BOOK, "upload": models.ItemKind.UPLOAD}
+
+
+def converted_voices(dp):
+    # Converted voices only; base TTS narrations are never evicted
+    return dp.query(models.Artifact).filter(
+        models.Artifact.variant.like("voice:%"),
+        models.Artifact.state == models.ArtifactState.READY
+    )
+
+
+class VoiceEvictor:
+    """Deletes the least recently played converted voices once they exceed the disk budget.
+
+    Plays are recorded in memory with ``touch`` and written in bulk on each
+    pass. An evicted voice loses its artifact row, so the next request for it
+    starts a fresh conversion.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._touches = {}
+
+    def touch(self, kind: str, owner_id: int, voice_id: int):
+        self._touches[(kind, owner_id, voice_id)] = datetime.utcnow()
+
+    def _flush_touches(self, dp):
+        touches, self._touches = self._touches, {}
+        for (kind, owner_id, voice_id), accessed_at in touches.items():
+            dp.query(models.Artifact).filter(
+                models.Artifact.owner_kind == ITEM_KINDS[kind],
+                models.Artifact.owner_id == owner_id,
+                models.Artifact.variant == f"voice:{voice_id}"
+            ).update({models.Artifact.last_accessed_at: accessed_at}, synchronize_session=False)
+
+    def _fill_sizes(self, dp):
+        for artifact in converted_voices(dp).filter(models.Artifact.size_bytes.is_(None)).all():
+            artifact.size_bytes = storage.size(artifact.audio) if storage.exists(artifact.audio) else 0
+            if artifact.last_accessed_at is None:
+                artifact.last_accessed_at = datetime.utcnow()
+
+    def _usage(self, dp):
+        return converted_voices(dp).with_entities(func.coalesce(func.sum(models.Artifact.size_bytes), 0)).scalar()
+
+    def _coldest(self, dp):
+        return converted_voices(dp).with_entities(
+            models.Artifact.last_accessed_at, models.Artifact.owner_kind, models.Artifact.owner_id,
+            models.Artifact.variant, models.Artifact.audio, models.Artifact.size_bytes
+        ).order_by(models.Artifact.last_accessed_at).limit(100).all()
+
+    def evict_once(self):
+        dp = SessionLocal()
+        try:
+            self._flush_touches(dp)
+            self._fill_sizes(dp)
+            dp.commit()
+
+            usage = self._usage(dp)
+            evicted = 0
+            while usage > self.budget_bytes:
+                candidates = self._coldest(dp)
+                if not candidates:
+                    break
+                for accessed_at, kind, owner_id, variant, audio, size in candidates:
+                    if usage <= self.budget_bytes:
+                        break
+                    dp.query(models.Artifact).filter(
+                        models.Artifact.owner_kind == kind,
+                        models.Artifact.owner_id == owner_id,
+                        models.Artifact.variant == variant
+                    ).delete(synchronize_session=False)
+                    dp.query(models.AudioMetadata).filter(
+                        models.AudioMetadata.item_kind == kind,
+                        models.AudioMetadata.item_id == owner_id,
+                        models.AudioMetadata.variant == variant
+                    ).delete(synchronize_session=False)
+                    dp.commit()
+                    storage.delete(audio)
+                    usage -= size or 0
+                    evicted += 1
+                    logger.info("Evicted %s %s %s (%s bytes, last played %s)",
+                                kind.value, owner_id, variant, size or 0, accessed_at)
+
+            return evicted
+        except SQLAlchemyError:
+            dp.rollback()
+            logger.exception("Voice eviction pass failed")
+            return 0
+        finally:
+            dp.close()
+
+    async def run(self, interval: float = EVICTION_INTERVAL_SECONDS):
+        while True:
+            await asyncio.to_thread(self.evict_once)
+            await asyncio.sleep(interval)
+
+
+evictor = VoiceEvictor(VOICE_AUDIO_BUDGET_BYTES)
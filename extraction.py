@@ -0,0 +1,90 @@
+from concurrent.futures import ProcessPoolExecutor
+from config import get_str, get_int
+import unicodedata
+import asyncio
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+TEXT_CACHE_DIR = get_str("TEXT_CACHE_DIR", os.path.join("Cache", "text"))
+EXTRACTION_WORKERS = get_int("EXTRACTION_WORKERS", 2)
+# Bump when the normalization rules change so stale cache entries are not reused
+EXTRACTION_VERSION = 1
+
+SENTENCE_END = re.compile(r"[.!?؟…]+[\"'”»)]*\s+")
+HYPHENATED_BREAK = re.compile(r"(\w)-\n(\w)")
+PAGE_NUMBER_LINE = re.compile(r"^\s*(?:-\s*)?\d+(?:\s*-)?\s*$", re.MULTILINE)
+WHITESPACE = re.compile(r"\s+")
+TATWEEL = "ـ"
+
+_pool = None
+
+
+def split_sentences(paragraph: str):
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(paragraph):
+        sentences.append(paragraph[start:match.end()].strip())
+        start = match.end()
+    sentences.append(paragraph[start:].strip())
+    return [sentence for sentence in sentences if sentence]
+
+
+def normalize_text(raw: str):
+    """Clean extracted PDF text and return it with one sentence per line."""
+    text = unicodedata.normalize("NFKC", raw)
+    text = text.replace(TATWEEL, "").replace("\r", "\n")
+    text = HYPHENATED_BREAK.sub(r"\1\2", text)
+    text = PAGE_NUMBER_LINE.sub("", text)
+
+    sentences = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = WHITESPACE.sub(" ", paragraph).strip()
+        if paragraph:
+            sentences.extend(split_sentences(paragraph))
+    return "\n".join(sentences) + "\n"
+
+
+def _extract_pdf(pdf_path: str, out_path: str):
+    # Runs in a worker process
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_path)
+    raw = "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(normalize_text(raw))
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def cached_text_path(content_hash: str, language):
+    return os.path.join(TEXT_CACHE_DIR, content_hash[:2], f"{content_hash}.{language.name.lower()}.v{EXTRACTION_VERSION}.txt")
+
+
+async def extract_text(pdf_path: str, language, content_hash: str):
+    """Return the path of the normalized text for a PDF, extracting it once per content hash."""
+    out_path = cached_text_path(content_hash, language)
+    if os.path.exists(out_path):
+        return out_path
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), _extract_pdf, pdf_path, out_path)
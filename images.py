@@ -0,0 +1,175 @@
+from fastapi import HTTPException, Depends, APIRouter, status, Request
+from fastapi.responses import FileResponse
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum as PyEnum
+from typing import Annotated, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from auth import get_read_db, get_optional_user_id
+from storage import storage
+from config import get_str, get_int, get_list
+import models
+import caching
+import hashlib
+import asyncio
+import os
+
+router = APIRouter(
+    prefix='/images',
+    tags=['Images']
+)
+
+IMAGE_CACHE_DIR = get_str("IMAGE_CACHE_DIR", os.path.join("Cache", "images"))
+IMAGE_WORKERS = get_int("IMAGE_WORKERS", 2)
+IMAGE_WIDTHS = [int(width) for width in get_list("IMAGE_WIDTHS")] or [96, 192, 384, 768]
+# Widths generated ahead of time when an image enters the catalog
+PREGENERATE_WIDTHS = [int(width) for width in get_list("IMAGE_PREGENERATE_WIDTHS")] or [192, 384]
+CACHE_CONTROL = "public, max-age=604800"
+PRIVATE_CACHE_CONTROL = "private, max-age=604800"
+
+read_dp_dependency = Annotated[Session, Depends(get_read_db)]
+optional_user_dependency = Annotated[Optional[int], Depends(get_optional_user_id)]
+
+
+class ImageKind(PyEnum):
+    BOOK = "book"
+    UPLOAD = "upload"
+    VOICE = "voice"
+    USER = "user"
+
+
+IMAGE_COLUMNS = {
+    ImageKind.BOOK: (models.Book.id, models.Book.cover_photo),
+    ImageKind.UPLOAD: (models.Upload.id, models.Upload.cover_photo),
+    ImageKind.VOICE: (models.Voice.id, models.Voice.photo),
+    ImageKind.USER: (models.User.id, models.User.profile_photo),
+}
+# Kinds only their owner may see
+OWNER_COLUMNS = {
+    ImageKind.UPLOAD: models.Upload.user_id,
+    ImageKind.USER: models.User.id,
+}
+
+_pool = None
+_source_hashes = {}
+_in_progress = {}
+
+
+def _resize(source_path: str, out_path: str, width: int):
+    # Runs in a worker process
+    from PIL import Image
+
+    with Image.open(source_path) as image:
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        tmp_path = f"{out_path}.{os.getpid()}.tmp"
+        image.save(tmp_path, "WEBP", quality=80, method=4)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def source_hash(path: str):
+    """SHA-256 of the source image, memoized on (path, size, mtime)."""
+    stat = os.stat(path)
+    signature = (path, stat.st_size, stat.st_mtime_ns)
+    digest = _source_hashes.get(signature)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if len(_source_hashes) > 10000:
+            _source_hashes.clear()
+        _source_hashes[signature] = digest
+    return digest
+
+
+def variant_path(digest: str, width: int):
+    return os.path.join(IMAGE_CACHE_DIR, digest[:2], f"{digest}_{width}.webp")
+
+
+async def get_variant(source_path: str, digest: str, width: int):
+    out_path = variant_path(digest, width)
+    if os.path.exists(out_path):
+        return out_path
+
+    # Concurrent requests for the same variant share one resize
+    future = _in_progress.get(out_path)
+    if future is None:
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        loop = asyncio.get_running_loop()
+        future = asyncio.ensure_future(loop.run_in_executor(get_pool(), _resize, source_path, out_path, width))
+        _in_progress[out_path] = future
+        future.add_done_callback(lambda _: _in_progress.pop(out_path, None))
+    return await future
+
+
+def pregenerate_sync(key: str, widths=None):
+    """Generate the common widths for an image, for callers outside the event loop."""
+    if not key or not storage.exists(key):
+        return
+    source_path = storage.fetch(key)
+    digest = source_hash(source_path)
+    for width in widths or PREGENERATE_WIDTHS:
+        out_path = variant_path(digest, width)
+        if not os.path.exists(out_path):
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            _resize(source_path, out_path, width)
+
+
+@router.get("/{kind}/{item_id}", response_class=FileResponse)
+async def get_image(kind: ImageKind, item_id: int, width: int, request: Request, dp: read_dp_dependency,
+                    user_id: optional_user_dependency):
+    if width not in IMAGE_WIDTHS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"width must be one of {IMAGE_WIDTHS}")
+
+    id_column, photo_column = IMAGE_COLUMNS[kind]
+    query = dp.query(photo_column).filter(id_column == item_id)
+    owner_column = OWNER_COLUMNS.get(kind)
+    cache_control = CACHE_CONTROL
+    if owner_column is not None:
+        if user_id is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user.")
+        # Someone else's image reads as missing rather than forbidden
+        query = query.filter(owner_column == user_id)
+        cache_control = PRIVATE_CACHE_CONTROL
+    try:
+        key = query.scalar()
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+
+    try:
+        # Objects that only live in the bucket are copied to the spool once
+        source_path = await asyncio.to_thread(storage.fetch, key) if key else None
+    except FileNotFoundError:
+        source_path = None
+    if not source_path:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+
+    digest = await asyncio.to_thread(source_hash, source_path)
+    etag = f'"{digest[:32]}-{width}"'
+    cached = caching.not_modified(request, etag)
+    if cached:
+        cached.headers["Cache-Control"] = cache_control
+        return cached
+
+    try:
+        path = await get_variant(source_path, digest, width)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Could not process image")
+
+    return FileResponse(path, media_type="image/webp", headers={"ETag": etag, "Cache-Control": cache_control})
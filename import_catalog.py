@@ -0,0 +1,215 @@
+"""Bulk import of catalog books from CSV or JSON-lines files.
+
+    python import_catalog.py books.jsonl [--batch-size 1000] [--dry-run] [--resume]
+                             [--assets-dir DIR] [--copy-workers 8]
+
+Rows are validated against the ``books`` columns and the ``Language`` enum,
+deduplicated on ISBN (the last row wins) and written in batches: one SELECT
+to find existing ISBNs, then one multi-row INSERT and one executemany UPDATE
+per batch, and one more UPDATE that gives books without narration keys the
+ones generated audio is written to. Cover and text assets are copied into storage concurrently and
+common cover thumbnail sizes are generated along the way.
+A checkpoint file next to the input records how many rows were committed,
+so ``--resume`` skips them after an interruption.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import insert, update, bindparam, func
+from sqlalchemy.exc import SQLAlchemyError
+from database import SessionLocal
+from models import Language
+from storage import storage, artifact_key
+import images
+import argparse
+import models
+import json
+import time
+import csv
+import sys
+import os
+
+FIELDS = ["title", "author", "publish_year", "category", "ISBN", "description", "cover_photo", "text",
+          "male_audio", "female_audio", "child_audio", "language"]
+ASSET_FIELDS = ["cover_photo", "text"]
+AUDIO_FIELDS = {"male_audio": "male.wav", "female_audio": "female.wav", "child_audio": "child.wav"}
+
+
+def read_records(path: str):
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def validate(raw: dict):
+    """Return a dict of Book column values, or raise ValueError."""
+    row = {}
+    for field in FIELDS:
+        value = raw.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        if value in (None, ""):
+            continue
+        if field == "language":
+            value = Language.from_str(value)
+        elif field == "publish_year":
+            value = int(value)
+        else:
+            value = str(value)
+            length = models.Book.__table__.c[field].type.length
+            if length and len(value) > length:
+                raise ValueError(f"{field} is longer than {length} characters")
+        row[field] = value
+
+    if not row.get("title"):
+        raise ValueError("title is required")
+    if not row.get("ISBN") or row["ISBN"] == "Undefined":
+        raise ValueError("ISBN is required for deduplication")
+    return row
+
+
+def copy_asset(field: str, source: str, assets_dir: str):
+    path = os.path.join(assets_dir, source) if assets_dir else source
+    if not os.path.exists(path):
+        return source
+    with open(path, "rb") as f:
+        key, _ = storage.save_stream(f, os.path.basename(path))
+    if field == "cover_photo":
+        try:
+            images.pregenerate_sync(key)
+        except Exception as e:
+            print(f"{source}: could not pre-generate thumbnails, {e}", file=sys.stderr)
+    return key
+
+
+def copy_assets(rows, assets_dir: str, executor: ThreadPoolExecutor):
+    jobs = [(row, field) for row in rows for field in ASSET_FIELDS if row.get(field)]
+    keys = executor.map(lambda job: copy_asset(job[1], job[0][job[1]], assets_dir), jobs)
+    for (row, field), key in zip(jobs, keys):
+        row[field] = key
+
+
+def write_batch(dp, rows):
+    """Upsert one batch keyed by ISBN; returns (inserted, updated)."""
+    existing = dict(dp.query(models.Book.ISBN, models.Book.id).filter(
+        models.Book.ISBN.in_([row["ISBN"] for row in rows])
+    ).all())
+
+    new_rows = [row for row in rows if row["ISBN"] not in existing]
+    updates = [{**row, "_id": existing[row["ISBN"]]} for row in rows if row["ISBN"] in existing]
+
+    # executemany needs the same columns in every parameter set, so group by column set
+    groups = {}
+    for row in new_rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    for group in groups.values():
+        dp.connection().execute(insert(models.Book), group)
+    # Likewise for updates: a column a row leaves out must keep its stored value, not become NULL
+    groups = {}
+    for row in updates:
+        groups.setdefault(tuple(sorted(c for c in row if c != "_id")), []).append(row)
+    for columns, group in groups.items():
+        params = [{"_id": row["_id"], **{f"v_{c}": row[c] for c in columns}} for row in group]
+        statement = update(models.Book).where(models.Book.id == bindparam("_id")).values(
+            {c: bindparam(f"v_{c}", type_=models.Book.__table__.c[c].type) for c in columns})
+        dp.connection().execute(statement, params)
+
+    # Narrations are generated under the book's id, so their keys can only be
+    # given once the rows exist; keys the file supplied are kept
+    ids = list(existing.values())
+    if new_rows:
+        ids += [book_id for (book_id,) in dp.query(models.Book.id).filter(
+            models.Book.ISBN.in_([row["ISBN"] for row in new_rows]))]
+    statement = update(models.Book).where(models.Book.id == bindparam("_id")).values(
+        {c: func.coalesce(models.Book.__table__.c[c], bindparam(f"v_{c}")) for c in AUDIO_FIELDS})
+    params = [{"_id": book_id, **{f"v_{c}": artifact_key("book", book_id, filename)
+                                  for c, filename in AUDIO_FIELDS.items()}} for book_id in ids]
+    if params:
+        dp.connection().execute(statement, params)
+    return len(new_rows), len(updates)
+
+
+def checkpoint_path(path: str):
+    return f"{path}.checkpoint"
+
+
+def run(path: str, batch_size: int, dry_run: bool, resume: bool, assets_dir: str, copy_workers: int):
+    skip = 0
+    if resume and os.path.exists(checkpoint_path(path)):
+        with open(checkpoint_path(path)) as f:
+            skip = int(f.read().strip() or 0)
+        print(f"Resuming after {skip} rows")
+
+    totals = {"read": 0, "invalid": 0, "inserted": 0, "updated": 0}
+    started = time.perf_counter()
+    dp = SessionLocal()
+    executor = ThreadPoolExecutor(max_workers=copy_workers)
+
+    def flush(batch, position):
+        # Dedupe within the batch on ISBN, last row wins
+        rows = list({row["ISBN"]: row for row in batch}.values())
+        batch_started = time.perf_counter()
+        if dry_run:
+            existing = dp.query(models.Book.ISBN).filter(
+                models.Book.ISBN.in_([r["ISBN"] for r in rows])).distinct().count()
+            inserted, updated = len(rows) - existing, existing
+        else:
+            copy_assets(rows, assets_dir, executor)
+            try:
+                inserted, updated = write_batch(dp, rows)
+                dp.commit()
+            except SQLAlchemyError:
+                dp.rollback()
+                raise
+            with open(checkpoint_path(path), "w") as f:
+                f.write(str(position))
+        totals["inserted"] += inserted
+        totals["updated"] += updated
+        elapsed = time.perf_counter() - batch_started
+        print(f"rows {position:>8}: +{inserted} new, {updated} updated, "
+              f"{len(rows) / max(elapsed, 1e-9):,.0f} rows/s")
+
+    try:
+        batch = []
+        position = 0
+        for position, raw in enumerate(read_records(path), start=1):
+            if position <= skip:
+                continue
+            totals["read"] += 1
+            try:
+                batch.append(validate(raw))
+            except (ValueError, TypeError) as e:
+                totals["invalid"] += 1
+                print(f"row {position}: skipped, {e}", file=sys.stderr)
+                continue
+            if len(batch) >= batch_size:
+                flush(batch, position)
+                batch = []
+        if batch:
+            flush(batch, position)
+    finally:
+        executor.shutdown()
+        dp.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"{'Dry run: ' if dry_run else ''}{totals['read']} rows read, {totals['invalid']} invalid, "
+          f"{totals['inserted']} inserted, {totals['updated']} updated in {elapsed:.1f}s "
+          f"({totals['read'] / max(elapsed, 1e-9):,.0f} rows/s)")
+    if not dry_run and os.path.exists(checkpoint_path(path)):
+        os.remove(checkpoint_path(path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import catalog books from CSV or JSON lines.")
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--assets-dir", default=None, help="Directory that cover_photo and text paths are relative to")
+    parser.add_argument("--copy-workers", type=int, default=8)
+    args = parser.parse_args()
+
+    run(args.path, args.batch_size, args.dry_run, args.resume, args.assets_dir, args.copy_workers)
@@ -1,22 +1,173 @@
-from fastapi import FastAPI, HTTPException, Depends, status
-from typing import Annotated
-import models
+from fastapi import FastAPI, HTTPException, Depends, status, Request, Response
+from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager, suppress
+from typing import Annotated, List
 import upload
-from database import engine, SessionLocal
+from database import engine, SessionLocal, replicas
+from sqlalchemy import text
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
 import auth
-from dotenv import dotenv_values
 from auth import get_current_user
 import book
+import progress
+import popularity
+import audio_index
+import images
+import voices
+import downloads
+import emails
+import asyncio
+import logging
+import caching
+import schemas
+import admission
+import circuit
+import extraction
+import tts_cache
+import artifacts
+from eviction import evictor
 
-app = FastAPI()
-models.Base.metadata.create_all(bind=engine)
 
-config_credentials = dotenv_values(".env")
+logger = logging.getLogger(__name__)
+
+
+async def warm_drive_service():
+    try:
+        await asyncio.to_thread(upload.get_drive_service)
+    except Exception:
+        # Retried lazily by the first upload
+        logger.exception("Could not build the Google Drive client")
+
+
+def ping_database():
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+async def warm_up(app: FastAPI, retry_seconds: float = 2.0):
+    """Mark the app ready once the database answers and the voice registry is loaded."""
+    while True:
+        try:
+            await asyncio.to_thread(ping_database)
+            await asyncio.to_thread(voices.registry.reload)
+        except SQLAlchemyError:
+            logger.exception("Startup warm-up failed, retrying")
+            await asyncio.sleep(retry_seconds)
+            continue
+        app.state.ready = True
+        return
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema management lives in create_db.py; nothing here touches DDL.
+    app.state.ready = False
+    app.state.email_outbox_task = asyncio.create_task(emails.outbox_sender.run())
+    app.state.replica_monitor = asyncio.create_task(replicas.monitor()) if replicas.replicas else None
+    app.state.voice_registry = asyncio.create_task(voices.registry.run())
+    app.state.evictor = asyncio.create_task(evictor.run())
+    app.state.artifact_reaper = asyncio.create_task(artifacts.run_reaper())
+    app.state.progress_flusher = asyncio.create_task(progress.progress_buffer.run())
+    app.state.popularity_flusher = asyncio.create_task(popularity.counter.run())
+    app.state.pregeneration = asyncio.create_task(popularity.scheduler.run(book.generate_book_voice))
+    # Build the Drive client off the event loop without delaying startup
+    app.state.drive_warmup = asyncio.create_task(warm_drive_service())
+    # Scan the TTS segment cache off the event loop
+    app.state.tts_cache_warmup = asyncio.create_task(asyncio.to_thread(tts_cache.segment_cache.load))
+    # /health/ready stays 503 until the database and voice registry are usable
+    app.state.warm_up = asyncio.create_task(warm_up(app))
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        app.state.warm_up.cancel()
+        extraction.shutdown()
+        images.shutdown()
+        app.state.voice_registry.cancel()
+        app.state.evictor.cancel()
+        app.state.artifact_reaper.cancel()
+        app.state.progress_flusher.cancel()
+        # Let an interrupted flush hand its rows back before the final one runs
+        with suppress(asyncio.CancelledError):
+            await app.state.progress_flusher
+        await progress.progress_buffer.flush()
+        app.state.pregeneration.cancel()
+        app.state.popularity_flusher.cancel()
+        await asyncio.to_thread(popularity.counter.flush)
+        if app.state.replica_monitor:
+            app.state.replica_monitor.cancel()
+        emails.outbox_sender.stop()
+        await app.state.email_outbox_task
+        engine.dispose()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 app.include_router(auth.router)
 app.include_router(book.router)
 app.include_router(upload.router)
+app.include_router(progress.router)
+app.include_router(audio_index.router)
+app.include_router(images.router)
+app.include_router(voices.router)
+app.include_router(downloads.router)
+caching.add_compression(app)
+
+
+@app.get("/health/live", response_model=schemas.Message)
+async def liveness():
+    return {"message": "alive"}
+
+
+@app.get("/health/ready", response_model=schemas.Message)
+def readiness():
+    if not getattr(app.state, "ready", False):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Starting up")
+
+    try:
+        ping_database()
+    except SQLAlchemyError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database unavailable")
+
+    return {"message": "ready"}
+
+
+@app.get("/health/backends", response_model=List[schemas.BackendLoad])
+async def backend_load():
+    return [admission.tts.stats(), admission.voice_changer.stats()]
+
+
+@app.get("/health/breakers", response_model=List[schemas.BreakerStatus])
+async def breaker_status():
+    return [breaker.stats() for breaker in circuit.breakers]
+
+
+@app.get("/health/tts_cache", response_model=schemas.TTSCacheStats)
+async def tts_cache_stats():
+    return tts_cache.segment_cache.stats()
+
+
+@app.get("/health/upload_synthesis", response_model=schemas.SynthesisStats)
+async def upload_synthesis_stats():
+    return upload.tracker.stats()
+
+
+@app.get("/health/pregeneration", response_model=schemas.PregenerationStats)
+async def pregeneration_stats():
+    return popularity.scheduler.stats()
+
+
+@app.get("/health/replicas", response_model=List[schemas.ReplicaStatus])
+async def replica_health():
+    return [
+        {
+            "host": replica.url.host,
+            "healthy": replica in replicas.healthy,
+            "lag": replicas.lag.get(replica.url.host)
+        }
+        for replica in replicas.replicas
+    ]
 
 
 def get_db():
@@ -31,7 +182,7 @@ dp_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
 
-@app.get("/", response_model=dict, status_code=status.HTTP_200_OK)
+@app.get("/", response_model=schemas.UserDetails, status_code=status.HTTP_200_OK)
 async def user(cur_user: user_dependency):
     if cur_user is None:
         raise HTTPException(status_code=401, detail="Authentication Failed")
@@ -47,19 +198,11 @@ async def user(cur_user: user_dependency):
     return user_details
 
 
-@app.get("/get_all_voices/")
-async def get_all_voices(dp: dp_dependency):
-    voices = dp.query(models.Voice).all()
-    voices_info_list = []
-    for voice in voices:
-        voice_info = {
-            "id": voice.id,
-            "name": voice.name,
-            "photo": voice.photo,
-            "gender": voice.gender,
-            "audio": voice.audio
-        }
-        voices_info_list.append(voice_info)
-
-    return voices_info_list
-
+@app.get("/get_all_voices/", response_model=List[schemas.VoiceInfo])
+async def get_all_voices(request: Request):
+    # Served from the in-memory voice registry; no database round trip
+    snapshot = voices.registry.snapshot
+    cached = caching.not_modified(request, snapshot.etag)
+    if cached:
+        return cached
+    return Response(snapshot.listing, media_type="application/json", headers={"ETag": snapshot.etag})
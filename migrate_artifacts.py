@@ -0,0 +1,118 @@
+"""Carry voice and narration state over into the ``artifacts`` table.
+
+    python create_db.py
+    python migrate_artifacts.py [--batch-size 1000] [--dry-run]
+
+Converted voices come from ``book_voices``/``book_voice_status`` and
+``upload_voices``/``upload_voice_status``: a finished status with an audio row
+becomes Ready, anything else becomes Failed so the next request retries it.
+Base narrations become Ready wherever their file is present in storage.
+Rows already in ``artifacts`` are left alone, so the script can be re-run.
+"""
+from datetime import datetime
+from sqlalchemy import insert, and_
+from database import SessionLocal
+from models import ArtifactState, ItemKind
+from storage import storage
+import audio_index
+import argparse
+import models
+
+INTERRUPTED = "Interrupted by the migration to the artifacts table"
+
+
+def voice_rows(dp, kind: ItemKind, status_model, voice_model, owner_column: str):
+    status_owner = getattr(status_model, owner_column)
+    voice_owner = getattr(voice_model, owner_column)
+    columns = [status_owner, status_model.voice_id, status_model.status, voice_model.audio,
+               voice_model.size_bytes, voice_model.last_accessed_at]
+    if hasattr(voice_model, "audio_id"):
+        columns.append(voice_model.audio_id)
+
+    rows = dp.query(*columns).outerjoin(
+        voice_model, and_(voice_owner == status_owner, voice_model.voice_id == status_model.voice_id)
+    ).yield_per(1000)
+
+    now = datetime.utcnow()
+    for owner_id, voice_id, done, audio, size, accessed_at, *audio_id in rows:
+        ready = bool(done and audio)
+        yield {
+            "owner_kind": kind,
+            "owner_id": owner_id,
+            "variant": audio_index.voice_variant(voice_id),
+            "state": ArtifactState.READY if ready else ArtifactState.FAILED,
+            "audio": audio,
+            "audio_id": audio_id[0] if audio_id else None,
+            "error": None if ready else INTERRUPTED,
+            "attempts": 1,
+            "size_bytes": size,
+            "last_accessed_at": accessed_at,
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+def base_rows(dp, kind: ItemKind, model):
+    rows = dp.query(model.id, model.male_audio, model.female_audio, model.child_audio).yield_per(1000)
+    now = datetime.utcnow()
+    for owner_id, *audios in rows:
+        for gender, audio in enumerate(audios):
+            if not storage.exists(audio):
+                continue
+            yield {
+                "owner_kind": kind,
+                "owner_id": owner_id,
+                "variant": audio_index.base_variant(gender),
+                "state": ArtifactState.READY,
+                "audio": audio,
+                "audio_id": None,
+                "error": None,
+                "attempts": 1,
+                "size_bytes": None,
+                "last_accessed_at": None,
+                "created_at": now,
+                "updated_at": now,
+            }
+
+
+def write(dp, batch, dry_run: bool):
+    if not batch or dry_run:
+        return 0
+    result = dp.execute(insert(models.Artifact).prefix_with("IGNORE"), batch)
+    dp.commit()
+    return result.rowcount
+
+
+def migrate(batch_size: int, dry_run: bool):
+    read_dp = SessionLocal()
+    write_dp = SessionLocal()
+    try:
+        sources = [
+            ("book voices", voice_rows(read_dp, ItemKind.BOOK, models.BookVoiceStatus, models.BookVoice, "book_id")),
+            ("upload voices", voice_rows(read_dp, ItemKind.UPLOAD, models.UploadVoiceStatus, models.UploadVoice,
+                                         "upload_id")),
+            ("book narrations", base_rows(read_dp, ItemKind.BOOK, models.Book)),
+            ("upload narrations", base_rows(read_dp, ItemKind.UPLOAD, models.Upload)),
+        ]
+        for name, rows in sources:
+            seen = written = 0
+            batch = []
+            for row in rows:
+                seen += 1
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    written += write(write_dp, batch, dry_run)
+                    batch = []
+            written += write(write_dp, batch, dry_run)
+            print(f"{name}: {seen} found, {written} written")
+    finally:
+        read_dp.close()
+        write_dp.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate voice state into the artifacts table.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    migrate(args.batch_size, args.dry_run)
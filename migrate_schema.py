@@ -0,0 +1,59 @@
+"""Add the columns and indexes that ``models.py`` has gained to existing tables.
+
+    python migrate_schema.py [--dry-run]
+    python create_db.py
+
+``create_db.py`` only creates missing tables; this script brings tables that
+already exist up to date: every model column missing from the database is
+added (with its index), and timestamp columns that default to "now" are
+filled in for existing rows so version stamps and eviction see a value.
+Columns already present are left alone, so the script can be re-run.
+"""
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from database import engine
+import argparse
+import models
+
+
+def missing_columns(inspector, table):
+    present = {column["name"] for column in inspector.get_columns(table.name)}
+    return [column for column in table.columns if column.name not in present]
+
+
+def defaults_to_now(column):
+    default = column.default
+    return default is not None and default.is_callable and default.arg.__name__ == "utcnow"
+
+
+def statements(connection):
+    inspector = inspect(connection)
+    existing = set(inspector.get_table_names())
+    for table in models.Base.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        for column in missing_columns(inspector, table):
+            ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            yield text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"), {}
+            for index in table.indexes:
+                if column in index.columns.values():
+                    yield CreateIndex(index), {}
+            if defaults_to_now(column):
+                yield text(f"UPDATE {table.name} SET {column.name} = :now WHERE {column.name} IS NULL"), \
+                    {"now": datetime.utcnow()}
+
+
+def migrate(dry_run: bool):
+    with engine.begin() as connection:
+        for statement, params in list(statements(connection)):
+            print(str(statement.compile(dialect=connection.dialect)).strip())
+            if not dry_run:
+                connection.execute(statement, params)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add new model columns to existing tables.")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    migrate(args.dry_run)
@@ -1,7 +1,13 @@
-from sqlalchemy import Boolean, Column, Integer, String, Date, ForeignKey, PrimaryKeyConstraint, Enum
+from sqlalchemy import Boolean, Column, Integer, BigInteger, String, Date, DateTime, Text, JSON, ForeignKey, PrimaryKeyConstraint, Enum
 from sqlalchemy.orm import relationship
 from database import Base
 from enum import Enum as PyEnum
+from datetime import datetime
+from sqlalchemy.dialects import mysql
+
+# Microsecond precision on MySQL, so version stamps (caching.table_version)
+# tell apart changes made within the same second
+Timestamp = DateTime().with_variant(mysql.DATETIME(fsp=6), "mysql")
 
 
 class Language(PyEnum):
@@ -49,6 +55,7 @@ class Book(Base):
     male_audio = Column(String(200))
     text = Column(String(200))
     language = Column(Enum(Language), nullable=False, default=Language.ENGLISH)
+    updated_at = Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     # Relationship
     users = relationship("UserBook", back_populates="book")
@@ -61,6 +68,7 @@ class UserBook(Base):
 
     user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
     book_id = Column(Integer, ForeignKey('books.id'), primary_key=True)
+    created_at = Column(Timestamp, default=datetime.utcnow)
 
     user = relationship("User", back_populates="books")
     book = relationship("Book", back_populates="users")
@@ -78,6 +86,7 @@ class Voice(Base):
     photo = Column(String(200))
     gender = Column(String(10), nullable=False)
     audio = Column(String(200))
+    updated_at = Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     # Relationships
     story_voices = relationship("BookVoice", back_populates="voice")
@@ -107,6 +116,7 @@ class Upload(Base):
     drive_folder_id = Column(String(200))
 
     language = Column(Enum(Language), nullable=False, default=Language.ENGLISH)
+    updated_at = Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     user = relationship("User", back_populates="uploads")
     upload_voice_status = relationship("UploadVoiceStatus", back_populates="upload")
@@ -123,6 +133,8 @@ class BookVoice(Base):
     book_id = Column(Integer, ForeignKey('books.id'), primary_key=True)
     voice_id = Column(Integer, ForeignKey('voices.id'), primary_key=True)
     audio = Column(String(200), nullable=False)
+    size_bytes = Column(BigInteger)
+    last_accessed_at = Column(DateTime, index=True)
 
     book = relationship("Book", back_populates="book_voices")
     voice = relationship("Voice", back_populates="story_voices")
@@ -141,6 +153,7 @@ class VoicesConfigs(Base):
     voice_id = Column(Integer, ForeignKey('voices.id'), primary_key=True, index=True)
     transpose = Column(Integer,default=0)
     model_name = Column(String(200), nullable=False)
+    updated_at = Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     # Relationships
     voice = relationship("Voice", back_populates="configs")
@@ -189,6 +202,8 @@ class UploadVoice(Base):
     voice_id = Column(Integer, ForeignKey('voices.id'), primary_key=True)
     audio = Column(String(200), nullable=False)
     audio_id = Column(String(200))
+    size_bytes = Column(BigInteger)
+    last_accessed_at = Column(DateTime, index=True)
 
     upload = relationship("Upload", back_populates="upload_voices")
     voice = relationship("Voice", back_populates="upload_voices")
@@ -199,3 +214,127 @@ class UploadVoice(Base):
 
     def __repr__(self):
         return f"<StoryVoice(story_id={self.upload_id}, voice_id={self.voice_id}, audio_path='{self.audio}')>"
+
+
+class EmailStatus(PyEnum):
+    PENDING = "Pending"
+    SENT = "Sent"
+    FAILED = "Failed"
+
+
+class EmailOutbox(Base):
+    __tablename__ = 'email_outbox'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    recipient = Column(String(200), nullable=False)
+    subject = Column(String(200), nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(Enum(EmailStatus), nullable=False, default=EmailStatus.PENDING, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String(500))
+    next_attempt_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime)
+
+    def __repr__(self):
+        return f"<EmailOutbox(id={self.id}, recipient='{self.recipient}', status={self.status})>"
+
+
+class ItemKind(PyEnum):
+    BOOK = "Book"
+    UPLOAD = "Upload"
+
+
+class ListeningProgress(Base):
+    __tablename__ = 'listening_progress'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    item_kind = Column(Enum(ItemKind), primary_key=True)
+    item_id = Column(Integer, primary_key=True)
+    voice_id = Column(Integer, ForeignKey('voices.id'))
+    offset_ms = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('user_id', 'item_kind', 'item_id'),
+    )
+
+    def __repr__(self):
+        return f"<ListeningProgress(user_id={self.user_id}, item={self.item_kind}:{self.item_id}, offset_ms={self.offset_ms})>"
+
+
+class VoicePopularity(Base):
+    __tablename__ = 'voice_popularity'
+
+    book_id = Column(Integer, ForeignKey('books.id'), primary_key=True)
+    voice_id = Column(Integer, ForeignKey('voices.id'), primary_key=True)
+    requests = Column(BigInteger, nullable=False, default=0)
+    plays = Column(BigInteger, nullable=False, default=0, index=True)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('book_id', 'voice_id'),
+    )
+
+    def __repr__(self):
+        return f"<VoicePopularity(book_id={self.book_id}, voice_id={self.voice_id}, plays={self.plays})>"
+
+
+class AudioMetadata(Base):
+    __tablename__ = 'audio_metadata'
+
+    item_kind = Column(Enum(ItemKind), primary_key=True)
+    item_id = Column(Integer, primary_key=True)
+    # "base:<gender>" for TTS narrations, "voice:<voice_id>" for converted voices
+    variant = Column(String(20), primary_key=True)
+    audio = Column(String(200), nullable=False)
+    format = Column(String(10))
+    duration_ms = Column(BigInteger)
+    bitrate = Column(Integer)
+    size_bytes = Column(BigInteger, nullable=False)
+    checksum = Column(String(64), nullable=False)
+    # [{"title": ..., "start_ms": ..., "start_byte": ...}, ...] in playback order
+    chapters = Column(JSON, nullable=False, default=list)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('item_kind', 'item_id', 'variant'),
+    )
+
+    def __repr__(self):
+        return f"<AudioMetadata(item={self.item_kind}:{self.item_id}, variant='{self.variant}', size_bytes={self.size_bytes})>"
+
+
+class ArtifactState(PyEnum):
+    PENDING = "Pending"
+    PROCESSING = "Processing"
+    READY = "Ready"
+    FAILED = "Failed"
+
+
+class Artifact(Base):
+    """Generation state of one audio artifact: a base narration or a converted voice."""
+    __tablename__ = 'artifacts'
+
+    owner_kind = Column(Enum(ItemKind), primary_key=True)
+    owner_id = Column(Integer, primary_key=True)
+    # Same variant names as AudioMetadata: "base:<gender>" or "voice:<voice_id>"
+    variant = Column(String(20), primary_key=True)
+    state = Column(Enum(ArtifactState), nullable=False, default=ArtifactState.PENDING, index=True)
+    audio = Column(String(200))
+    audio_id = Column(String(200))
+    error = Column(String(500))
+    attempts = Column(Integer, nullable=False, default=1)
+    size_bytes = Column(BigInteger)
+    last_accessed_at = Column(DateTime, index=True)
+    # When the current Pending or Processing claim was taken; old claims are failed
+    claimed_at = Column(DateTime)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('owner_kind', 'owner_id', 'variant'),
+    )
+
+    def __repr__(self):
+        return f"<Artifact(owner={self.owner_kind}:{self.owner_id}, variant='{self.variant}', state={self.state})>"
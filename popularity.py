@@ -0,0 +1,199 @@
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import and_, func
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.dialects.mysql import insert
+from database import SessionLocal
+from storage import storage, artifact_key
+from config import get_int, get_float
+import models
+import admission
+import circuit
+import artifacts
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+POPULARITY_FLUSH_SECONDS = get_float("POPULARITY_FLUSH_SECONDS", 30)
+PREGENERATE_INTERVAL_SECONDS = get_float("PREGENERATE_INTERVAL_SECONDS", 60)
+PREGENERATE_TOP_N = get_int("PREGENERATE_TOP_N", 20)
+
+
+class PopularityCounter:
+    """Play and request counts per (book_id, voice_id), aggregated in memory."""
+
+    def __init__(self):
+        self._requests = Counter()
+        self._plays = Counter()
+
+    def record_request(self, book_id: int, voice_id: int):
+        self._requests[(book_id, voice_id)] += 1
+
+    def record_play(self, book_id: int, voice_id: int):
+        self._plays[(book_id, voice_id)] += 1
+
+    @staticmethod
+    def _write(dp, rows):
+        statement = insert(models.VoicePopularity).values(rows)
+        statement = statement.on_duplicate_key_update(
+            requests=models.VoicePopularity.requests + statement.inserted.requests,
+            plays=models.VoicePopularity.plays + statement.inserted.plays,
+            updated_at=statement.inserted.updated_at
+        )
+        dp.execute(statement)
+        dp.commit()
+
+    def _write_each(self, dp, rows):
+        written = 0
+        for row in rows:
+            try:
+                self._write(dp, [row])
+                written += 1
+            except IntegrityError as e:
+                dp.rollback()
+                logger.warning("Dropping popularity of book %s voice %s: %s", row["book_id"], row["voice_id"], e.orig)
+        return written
+
+    def flush(self):
+        requests, self._requests = self._requests, Counter()
+        plays, self._plays = self._plays, Counter()
+        keys = set(requests) | set(plays)
+        if not keys:
+            return 0
+
+        now = datetime.utcnow()
+        rows = [
+            {"book_id": book_id, "voice_id": voice_id, "requests": requests[(book_id, voice_id)],
+             "plays": plays[(book_id, voice_id)], "updated_at": now}
+            for book_id, voice_id in keys
+        ]
+
+        dp = SessionLocal()
+        try:
+            try:
+                self._write(dp, rows)
+            except IntegrityError:
+                # A deleted book or voice fails the whole statement; keep the
+                # other counts and drop that row instead of re-queueing it forever
+                dp.rollback()
+                return self._write_each(dp, rows)
+        except SQLAlchemyError:
+            dp.rollback()
+            logger.exception("Popularity flush failed, keeping counts for the next flush")
+            self._requests.update(requests)
+            self._plays.update(plays)
+            return 0
+        finally:
+            dp.close()
+        return len(rows)
+
+    async def run(self, interval: float = POPULARITY_FLUSH_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.flush)
+
+
+def with_narrations(rows, limit: int):
+    candidates = []
+    for book_id, voice_id, book in rows:
+        # Conversion needs the base narrations, which only on-demand requests generate
+        if all(storage.exists(audio) for audio in (book.male_audio, book.female_audio, book.child_audio)):
+            candidates.append((book_id, voice_id))
+        if len(candidates) >= limit:
+            break
+    return candidates
+
+
+class PregenerationScheduler:
+    """Converts the most requested missing book voices while the voice changer is idle.
+
+    ``predicted_hits`` counts requests that found a pre-generated voice ready,
+    ``on_demand`` counts requests that still had to start a conversion.
+    """
+
+    def __init__(self, top_n: int):
+        self.top_n = top_n
+        self.pregenerated = set()
+        self.predicted_hits = 0
+        self.on_demand = 0
+
+    def record_ready(self, book_id: int, voice_id: int):
+        if (book_id, voice_id) in self.pregenerated:
+            self.pregenerated.discard((book_id, voice_id))
+            self.predicted_hits += 1
+
+    def record_on_demand(self, book_id: int, voice_id: int):
+        self.on_demand += 1
+
+    def idle_slots(self):
+        backend = admission.voice_changer
+        if circuit.voice_changer.is_open:
+            return 0
+        return max(0, backend.capacity - backend.in_flight - backend.queued)
+
+    async def candidates(self, dp, limit: int):
+        rows = dp.query(models.VoicePopularity.book_id, models.VoicePopularity.voice_id, models.Book).join(
+            models.Book, models.Book.id == models.VoicePopularity.book_id
+        ).outerjoin(
+            models.Artifact,
+            and_(models.Artifact.owner_kind == models.ItemKind.BOOK,
+                 models.Artifact.owner_id == models.VoicePopularity.book_id,
+                 models.Artifact.variant == func.concat("voice:", models.VoicePopularity.voice_id))
+        ).filter(
+            models.Artifact.owner_id.is_(None)
+        ).order_by(
+            (models.VoicePopularity.plays + models.VoicePopularity.requests).desc()
+        ).limit(self.top_n).all()
+
+        # storage.exists can be a bucket round trip
+        return await asyncio.to_thread(with_narrations, rows, limit)
+
+    async def pregenerate_once(self, generate):
+        slots = self.idle_slots()
+        if not slots:
+            return 0
+
+        dp = SessionLocal()
+        try:
+            started = 0
+            for book_id, voice_id in await self.candidates(dp, slots):
+                try:
+                    ticket = admission.voice_changer.admit()
+                except Exception:
+                    break
+                if not artifacts.start(models.ItemKind.BOOK, book_id, f"voice:{voice_id}"):
+                    ticket.cancel()
+                    continue
+                out_key = artifact_key("book", book_id, f"voice_{voice_id}.mp3")
+                try:
+                    await ticket.run(generate, book_id, voice_id, out_key, dp)
+                except Exception as e:
+                    logger.warning("Pre-generation of book %s voice %s failed: %s", book_id, voice_id, e)
+                    continue
+                self.pregenerated.add((book_id, voice_id))
+                started += 1
+            return started
+        except SQLAlchemyError:
+            logger.exception("Pre-generation query failed")
+            return 0
+        finally:
+            dp.close()
+
+    async def run(self, generate, interval: float = PREGENERATE_INTERVAL_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            await self.pregenerate_once(generate)
+
+    def stats(self):
+        served = self.predicted_hits + self.on_demand
+        return {
+            "pending_predictions": len(self.pregenerated),
+            "predicted_hits": self.predicted_hits,
+            "on_demand": self.on_demand,
+            "predicted_hit_rate": round(self.predicted_hits / served, 4) if served else 0.0
+        }
+
+
+counter = PopularityCounter()
+scheduler = PregenerationScheduler(PREGENERATE_TOP_N)
@@ -0,0 +1,179 @@
+from fastapi import HTTPException, Depends, APIRouter, status
+from typing import Annotated
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.dialects.mysql import insert
+from database import SessionLocal
+from auth import get_current_user_id, get_read_db
+from config import get_float
+from models import ItemKind
+import models
+import schemas
+import voices
+import asyncio
+import logging
+
+router = APIRouter(
+    prefix='/progress',
+    tags=['Progress']
+)
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_FLUSH_SECONDS = get_float("PROGRESS_FLUSH_SECONDS", 5)
+
+read_dp_dependency = Annotated[Session, Depends(get_read_db)]
+user_id_dependency = Annotated[int, Depends(get_current_user_id)]
+
+
+def write_progress_batch(rows):
+    """Bulk upsert progress rows; a row only moves forward in time."""
+    statement = insert(models.ListeningProgress).values(rows)
+    newer = statement.inserted.updated_at > models.ListeningProgress.updated_at
+    statement = statement.on_duplicate_key_update(
+        voice_id=func.if_(newer, statement.inserted.voice_id, models.ListeningProgress.voice_id),
+        offset_ms=func.if_(newer, statement.inserted.offset_ms, models.ListeningProgress.offset_ms),
+        updated_at=func.if_(newer, statement.inserted.updated_at, models.ListeningProgress.updated_at)
+    )
+
+    dp = SessionLocal()
+    try:
+        dp.execute(statement)
+        dp.commit()
+    finally:
+        dp.close()
+
+
+class ProgressBuffer:
+    """Write-behind buffer for playback heartbeats.
+
+    Heartbeats are coalesced per (user, item) so only the latest position is
+    kept, and ``flush`` writes everything buffered in one bulk upsert. Reads
+    check the buffer (including a batch that is being flushed) before the
+    database.
+    """
+
+    def __init__(self, writer=write_progress_batch, batch_size: int = 1000):
+        self.writer = writer
+        self.batch_size = batch_size
+        self._pending = {}
+        self._flushing = {}
+        self.heartbeats = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+
+    def record(self, user_id: int, kind: ItemKind, item_id: int, voice_id: int, offset_ms: int):
+        self.heartbeats += 1
+        self._pending[(user_id, kind, item_id)] = (voice_id, offset_ms, datetime.utcnow())
+
+    def get(self, user_id: int, kind: ItemKind, item_id: int):
+        key = (user_id, kind, item_id)
+        return self._pending.get(key) or self._flushing.get(key)
+
+    async def flush(self):
+        if not self._pending:
+            return 0
+        self._flushing, self._pending = self._pending, {}
+        rows = [
+            {
+                "user_id": user_id,
+                "item_kind": kind,
+                "item_id": item_id,
+                "voice_id": voice_id,
+                "offset_ms": offset_ms,
+                "updated_at": updated_at
+            }
+            for (user_id, kind, item_id), (voice_id, offset_ms, updated_at) in self._flushing.items()
+        ]
+        try:
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                try:
+                    await asyncio.to_thread(self.writer, batch)
+                    self.rows_written += len(batch)
+                except IntegrityError:
+                    # A row pointing at a deleted user or voice fails the whole
+                    # statement; write the others and drop it rather than retry forever
+                    await asyncio.to_thread(self._write_each, batch)
+        except SQLAlchemyError:
+            logger.exception("Progress flush failed, keeping %s rows for the next flush", len(rows))
+            # Newer heartbeats that arrived meanwhile win over the failed batch
+            self._pending = {**self._flushing, **self._pending}
+        except asyncio.CancelledError:
+            # Shutdown: hand the rows back to the final flush
+            self._pending = {**self._flushing, **self._pending}
+            raise
+        finally:
+            self._flushing = {}
+        return len(rows)
+
+    def _write_each(self, rows):
+        for row in rows:
+            try:
+                self.writer([row])
+                self.rows_written += 1
+            except IntegrityError as e:
+                self.rows_dropped += 1
+                logger.warning("Dropping progress of user %s on %s %s: %s", row["user_id"],
+                               row["item_kind"].value, row["item_id"], e.orig)
+
+    async def run(self, interval: float = PROGRESS_FLUSH_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+
+progress_buffer = ProgressBuffer()
+
+
+def check_item(dp: Session, user_id: int, kind: ItemKind, item_id: int):
+    if kind == ItemKind.BOOK:
+        found = dp.query(models.Book.id).filter(models.Book.id == item_id).first()
+    else:
+        found = dp.query(models.Upload.id).filter(
+            models.Upload.id == item_id,
+            models.Upload.user_id == user_id
+        ).first()
+    if not found:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{kind.value} not found")
+
+
+@router.post("/", response_model=schemas.Message, status_code=status.HTTP_202_ACCEPTED)
+async def report_progress(progress: schemas.ProgressReport, user_id: user_id_dependency, dp: read_dp_dependency):
+    if progress.voice_id is not None and voices.registry.get(progress.voice_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Voice not found")
+    # Only the first heartbeat of a flush interval pays for the lookup
+    if progress_buffer.get(user_id, progress.kind, progress.item_id) is None:
+        try:
+            check_item(dp, user_id, progress.kind, progress.item_id)
+        except SQLAlchemyError as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+
+    progress_buffer.record(user_id, progress.kind, progress.item_id, progress.voice_id, progress.offset_ms)
+    return {"message": "Progress recorded"}
+
+
+@router.get("/{kind}/{item_id}", response_model=schemas.Progress)
+async def get_progress(kind: ItemKind, item_id: int, user_id: user_id_dependency, dp: read_dp_dependency):
+    buffered = progress_buffer.get(user_id, kind, item_id)
+    if buffered:
+        voice_id, offset_ms, updated_at = buffered
+        return {"kind": kind, "item_id": item_id, "voice_id": voice_id, "offset_ms": offset_ms,
+                "updated_at": updated_at}
+
+    try:
+        progress = dp.query(models.ListeningProgress).filter(
+            models.ListeningProgress.user_id == user_id,
+            models.ListeningProgress.item_kind == kind,
+            models.ListeningProgress.item_id == item_id
+        ).first()
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+
+    if not progress:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No progress saved")
+
+    return {"kind": kind, "item_id": item_id, "voice_id": progress.voice_id, "offset_ms": progress.offset_ms,
+            "updated_at": progress.updated_at}
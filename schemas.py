@@ -0,0 +1,197 @@
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List
+from datetime import datetime
+from models import ItemKind
+
+
+class Message(BaseModel):
+    message: str
+
+
+class UserDetails(BaseModel):
+    id: int
+    username: str
+    email: str
+    birthdate: str
+    profile_photo: Optional[str] = None
+
+
+class BookSummary(BaseModel):
+    id: int
+    title: Optional[str] = None
+    author: Optional[str] = None
+    publish_year: Optional[int] = None
+    category: Optional[str] = None
+    cover_photo: Optional[str] = None
+
+
+class BookDetails(BaseModel):
+    id: int
+    title: Optional[str] = None
+    cover_photo: Optional[str] = None
+    author: Optional[str] = None
+    publish_year: Optional[int] = None
+    category: Optional[str] = None
+    ISBN: Optional[str] = None
+    description: Optional[str] = None
+    my_books: bool
+
+
+class MyBook(BaseModel):
+    id: int
+    title: Optional[str] = None
+    author: Optional[str] = None
+    text: Optional[str] = None
+    cover_photo: Optional[str] = None
+
+
+class BookIds(BaseModel):
+    book_ids: List[int]
+
+
+class LibraryResult(BaseModel):
+    book_id: int
+    # "added", "already_added" or "not_found"; "removed" or "not_in_library"
+    status: str
+
+
+class MyUpload(BaseModel):
+    id: int
+    title: Optional[str] = None
+    text: Optional[str] = None
+    cover_photo: Optional[str] = None
+
+
+class VoiceInfo(BaseModel):
+    id: int
+    name: str
+    photo: Optional[str] = None
+    gender: str
+    audio: Optional[str] = None
+
+
+class VoiceStatus(BaseModel):
+    voice_id: int
+    name: str
+    status: str
+    audio: Optional[str] = None
+
+
+class VoiceAudio(BaseModel):
+    """Either a progress ``message`` or the ready ``audio`` handle."""
+    message: Optional[str] = None
+    audio: Optional[str] = None
+    url: Optional[str] = None
+
+
+class ReplicaStatus(BaseModel):
+    host: Optional[str] = None
+    healthy: bool
+    lag: Optional[float] = None
+
+
+class BackendLoad(BaseModel):
+    backend: str
+    in_flight: int
+    queued: int
+    capacity: int
+    max_queued: int
+    avg_job_seconds: float
+    completed: int
+
+
+class BreakerStatus(BaseModel):
+    name: str
+    state: str
+    failures: int
+    retry_tokens: float
+    last_error: Optional[str] = None
+
+
+class TTSCacheStats(BaseModel):
+    entries: int
+    total_bytes: int
+    budget_bytes: int
+    hits: int
+    misses: int
+    hit_rate: float
+    bytes_saved: int
+    evictions: int
+
+
+class GenderProgress(BaseModel):
+    gender: str
+    state: str
+    done: int
+    total: Optional[int] = None
+
+
+class SynthesisProgress(BaseModel):
+    upload_id: int
+    batched: bool
+    seconds: float
+    voices: List[GenderProgress]
+
+
+class SynthesisStats(BaseModel):
+    completed: int
+    batched: int
+    avg_seconds: Optional[float] = None
+    last_seconds: Optional[float] = None
+
+
+class ProgressReport(BaseModel):
+    kind: ItemKind
+    item_id: int
+    voice_id: Optional[int] = None
+    offset_ms: int = Field(ge=0)
+
+
+class Progress(BaseModel):
+    kind: ItemKind
+    item_id: int
+    voice_id: Optional[int] = None
+    offset_ms: int
+    updated_at: datetime
+
+
+class PregenerationStats(BaseModel):
+    pending_predictions: int
+    predicted_hits: int
+    on_demand: int
+    predicted_hit_rate: float
+
+
+class Chapter(BaseModel):
+    title: str
+    start_ms: int
+    start_byte: int
+
+
+class AudioInfo(BaseModel):
+    format: Optional[str] = None
+    duration_ms: Optional[int] = None
+    bitrate: Optional[int] = None
+    size_bytes: int
+    checksum: str
+    chapters: List[Chapter]
+
+
+class ChapterRange(BaseModel):
+    chapter: int
+    title: str
+    start_ms: int
+    end_ms: Optional[int] = None
+    start_byte: int
+    end_byte: int
+    range: str
+
+
+def rows_response(rows, headers=None):
+    """Serialize column-tuple query rows straight to JSON.
+
+    Returning the response directly skips FastAPI's per-item validation and
+    ``jsonable_encoder`` pass; ``response_model`` still documents the shape.
+    """
+    return ORJSONResponse([row._asdict() for row in rows], headers=headers)
@@ -0,0 +1,226 @@
+from collections import OrderedDict
+from config import get_str, get_int
+import threading
+import hashlib
+import os
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _fan_out(digest: str):
+    return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+def artifact_key(kind: str, owner_id, filename: str):
+    """Key for a generated artifact, fanned out by a hash of its owner."""
+    digest = hashlib.sha1(f"{kind}/{owner_id}".encode()).hexdigest()
+    return f"{kind}/{_fan_out(digest)}/{filename}"
+
+
+def content_key(content_hash: str, filename: str, owner=None):
+    """Key for stored input bytes, addressed by their SHA-256.
+
+    With an ``owner`` the bytes are only shared between that owner's items, so
+    deleting one user's upload never removes another user's file.
+    """
+    if owner is not None:
+        return f"content/{_fan_out(content_hash)}/{owner}/{filename}"
+    return f"content/{_fan_out(content_hash)}/{filename}"
+
+
+class LocalStorage:
+    """Files under ``root``; keys are relative paths.
+
+    Older rows that hold plain relative paths keep working as keys.
+    """
+
+    def __init__(self, root: str, public_url: str = None):
+        self.root = root
+        self.public_url = public_url.rstrip("/") if public_url else None
+
+    def path_for(self, key: str):
+        """Filesystem path where this key's bytes live (or should be written by a producer)."""
+        if os.path.isabs(key):
+            return key
+        return os.path.join(self.root, *key.replace("\\", "/").split("/"))
+
+    def key_from_path(self, path: str):
+        if not os.path.isabs(path):
+            return path.replace("\\", "/")
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def exists(self, key: str):
+        return bool(key) and os.path.exists(self.path_for(key))
+
+    def size(self, key: str):
+        return os.path.getsize(self.path_for(key))
+
+    def save_stream(self, fileobj, filename: str, owner=None):
+        """Stream ``fileobj`` into content-addressed storage; returns (key, sha256)."""
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        tmp_path = os.path.join(self.root, f".incoming-{os.getpid()}-{id(fileobj)}")
+        with open(tmp_path, "wb") as out:
+            while chunk := fileobj.read(CHUNK_SIZE):
+                digest.update(chunk)
+                out.write(chunk)
+
+        content_hash = digest.hexdigest()
+        key = content_key(content_hash, filename, owner)
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        self.commit(key)
+        return key, content_hash
+
+    def commit(self, key: str):
+        """Publish bytes a producer wrote at ``path_for(key)``; nothing to do locally."""
+
+    def fetch(self, key: str):
+        """Local path holding the bytes of ``key``; raises FileNotFoundError if there are none."""
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(key)
+        return path
+
+    def open(self, key: str, start: int = 0, end: int = None, chunk_size: int = CHUNK_SIZE):
+        """Yield the bytes of ``key`` from ``start`` up to and excluding ``end``."""
+        with open(self.path_for(key), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key: str, expires: int = 3600):
+        """Direct URL served by the web server in front of ``root``, if one is configured."""
+        if not key or not self.public_url:
+            return None
+        return f"{self.public_url}/{self.key_from_path(key)}"
+
+
+class S3Storage(LocalStorage):
+    """S3-compatible bucket with a local spool for producers that write files.
+
+    Producer files leave the spool once committed. Copies downloaded by
+    ``fetch`` stay as a cache, evicted least recently used first once they
+    exceed ``spool_budget_bytes``. ``endpoint_url`` lets it run against a
+    local stand-in such as MinIO.
+    """
+
+    def __init__(self, bucket: str, spool_root: str, endpoint_url: str = None, region: str = None,
+                 url_expiry: int = 3600, spool_budget_bytes: int = 1024 ** 3):
+        super().__init__(spool_root)
+        import boto3
+
+        self.bucket = bucket
+        self.url_expiry = url_expiry
+        self.spool_budget_bytes = spool_budget_bytes
+        self._fetched = OrderedDict()
+        self._fetched_bytes = 0
+        self._lock = threading.Lock()
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+
+    def _head(self, key: str):
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key_from_path(key))
+        except ClientError:
+            return None
+
+    def exists(self, key: str):
+        return bool(key) and (super().exists(key) or self._head(key) is not None)
+
+    def size(self, key: str):
+        if super().exists(key):
+            return super().size(key)
+        return self._head(key)["ContentLength"]
+
+    def commit(self, key: str):
+        path = self.path_for(key)
+        self.client.upload_file(path, self.bucket, self.key_from_path(key))
+        self._forget(key)
+        super().delete(key)
+
+    def _forget(self, key: str):
+        with self._lock:
+            self._fetched_bytes -= self._fetched.pop(key, 0)
+
+    def _remember(self, key: str, size: int):
+        with self._lock:
+            self._fetched_bytes += size - self._fetched.get(key, 0)
+            self._fetched[key] = size
+            self._fetched.move_to_end(key)
+            while self._fetched_bytes > self.spool_budget_bytes and len(self._fetched) > 1:
+                old_key, old_size = self._fetched.popitem(last=False)
+                self._fetched_bytes -= old_size
+                super().delete(old_key)
+
+    def fetch(self, key: str):
+        """Download ``key`` into the spool unless a copy is already there."""
+        if super().exists(key):
+            with self._lock:
+                if key in self._fetched:
+                    self._fetched.move_to_end(key)
+            return self.path_for(key)
+        from botocore.exceptions import ClientError
+
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            self.client.download_file(self.bucket, self.key_from_path(key), f"{path}.download")
+        except ClientError:
+            raise FileNotFoundError(key)
+        os.replace(f"{path}.download", path)
+        self._remember(key, os.path.getsize(path))
+        return path
+
+    def open(self, key: str, start: int = 0, end: int = None, chunk_size: int = CHUNK_SIZE):
+        if super().exists(key):
+            yield from super().open(key, start, end, chunk_size)
+            return
+
+        byte_range = f"bytes={start}-" if end is None else f"bytes={start}-{end - 1}"
+        body = self.client.get_object(Bucket=self.bucket, Key=self.key_from_path(key), Range=byte_range)["Body"]
+        yield from body.iter_chunks(chunk_size)
+
+    def delete(self, key: str):
+        self._forget(key)
+        super().delete(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self.key_from_path(key))
+
+    def url(self, key: str, expires: int = None):
+        if not key:
+            return None
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.key_from_path(key)},
+            ExpiresIn=expires or self.url_expiry
+        )
+
+
+def create_storage():
+    if get_str("STORAGE_BACKEND", "local") == "s3":
+        return S3Storage(
+            bucket=get_str("S3_BUCKET"),
+            spool_root=get_str("STORAGE_ROOT", "."),
+            endpoint_url=get_str("S3_ENDPOINT_URL"),
+            region=get_str("S3_REGION"),
+            url_expiry=get_int("S3_URL_EXPIRY_SECONDS", 3600),
+            spool_budget_bytes=get_int("S3_SPOOL_BUDGET_BYTES", 1024 ** 3)
+        )
+    return LocalStorage(get_str("STORAGE_ROOT", "."), get_str("STORAGE_PUBLIC_URL"))
+
+
+storage = create_storage()
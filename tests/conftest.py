@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# Settings read at import time; real deployments take them from .env
+for key, value in {
+    "DATABASE_URL": "sqlite://",
+    "SECRET": "test-secret",
+    "ALGORITHM": "HS256",
+    "EMAIL": "noreply@example.com",
+    "PASS": "unused",
+    "SERVICE_ACCOUNT_FILE": "unused.json",
+    "PARENT_FOLDER_ID": "unused",
+}.items():
+    os.environ.setdefault(key, value)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import models  # noqa: E402
+
+
+@pytest.fixture
+def engine():
+    """In-memory SQLite copy of the schema, shared by every session of one test."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -0,0 +1,40 @@
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+
+import caching
+
+BODY = b"x" * 4096
+
+
+def make_client():
+    app = FastAPI()
+
+    @app.get("/json")
+    async def json_body():
+        return Response(BODY, media_type="application/json")
+
+    @app.get("/zip")
+    async def zip_body():
+        return Response(BODY, media_type="application/zip")
+
+    @app.get("/partial")
+    async def partial_body():
+        return Response(BODY, status_code=206, media_type="text/plain",
+                        headers={"Content-Range": f"bytes 0-{len(BODY) - 1}/{len(BODY) * 2}"})
+
+    caching.add_compression(app)
+    return TestClient(app)
+
+
+def test_text_responses_are_compressed():
+    response = make_client().get("/json", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] in ("gzip", "br")
+
+
+def test_binary_and_partial_responses_pass_through():
+    client = make_client()
+    for path in ("/zip", "/partial"):
+        response = client.get(path, headers={"Accept-Encoding": "gzip, br"})
+        assert "content-encoding" not in response.headers
+        assert response.headers["content-length"] == str(len(BODY))
+        assert response.content == BODY
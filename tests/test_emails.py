@@ -0,0 +1,97 @@
+import asyncio
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+
+import emails
+import models
+
+
+class Inbox:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    inbox = Inbox()
+    controller = Controller(inbox, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    monkeypatch.setattr(emails, "MAIL_SERVER", "127.0.0.1")
+    monkeypatch.setattr(emails, "MAIL_PORT", controller.port)
+    monkeypatch.setattr(emails, "MAIL_SSL_TLS", False)
+    monkeypatch.setattr(emails, "USE_CREDENTIALS", False)
+    yield inbox
+    controller.stop()
+
+
+@pytest.fixture
+def outbox(monkeypatch, session_factory):
+    monkeypatch.setattr(emails, "SessionLocal", session_factory)
+    dp = session_factory()
+    for i in range(3):
+        emails.enqueue_email(dp, f"reader{i}@example.com", "Welcome", f"<p>Hello {i}</p>")
+    dp.commit()
+    dp.close()
+    return session_factory
+
+
+def statuses(session_factory):
+    dp = session_factory()
+    try:
+        return [email.status for email in dp.query(models.EmailOutbox).order_by(models.EmailOutbox.id)]
+    finally:
+        dp.close()
+
+
+def test_outbox_is_delivered_through_smtp(smtp_server, outbox):
+    sender = emails.OutboxSender(rate_per_second=0)
+
+    async def send():
+        try:
+            return await sender.send_pending()
+        finally:
+            await sender._close()
+
+    assert asyncio.run(send()) == 3
+    assert sorted(rcpt for message in smtp_server.messages for rcpt in message.rcpt_tos) == [
+        "reader0@example.com", "reader1@example.com", "reader2@example.com"]
+    assert statuses(outbox) == [models.EmailStatus.SENT] * 3
+
+
+def test_claimed_rows_are_not_sent_by_another_sender(smtp_server, outbox):
+    dp = outbox()
+    claimed = datetime.utcnow() + timedelta(minutes=5)
+    dp.query(models.EmailOutbox).update({models.EmailOutbox.next_attempt_at: claimed})
+    dp.commit()
+    dp.close()
+
+    assert asyncio.run(emails.OutboxSender(rate_per_second=0).send_pending()) == 0
+    assert smtp_server.messages == []
+
+
+def test_failed_send_is_retried_later(monkeypatch, outbox):
+    monkeypatch.setattr(emails, "MAIL_SERVER", "127.0.0.1")
+    monkeypatch.setattr(emails, "MAIL_PORT", free_port())
+    monkeypatch.setattr(emails, "MAIL_SSL_TLS", False)
+    monkeypatch.setattr(emails, "USE_CREDENTIALS", False)
+
+    assert asyncio.run(emails.OutboxSender(rate_per_second=0).send_pending()) == 3
+
+    dp = outbox()
+    rows = dp.query(models.EmailOutbox).all()
+    assert all(row.status == models.EmailStatus.PENDING and row.attempts == 1 for row in rows)
+    assert all(row.next_attempt_at > datetime.utcnow() for row in rows)
+    dp.close()
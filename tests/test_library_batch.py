@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import event
+
+import book
+import models
+
+USER_ID = 1
+
+
+@pytest.fixture
+def dp(engine, session_factory):
+    dp = session_factory()
+    dp.add(models.User(id=USER_ID, username="reader", email="reader@example.com", password="x"))
+    dp.add_all(models.Book(id=book_id, title=f"Book {book_id}") for book_id in range(1, 101))
+    dp.commit()
+    yield dp
+    dp.close()
+
+
+@pytest.fixture
+def statements(engine):
+    seen = []
+    event.listen(engine, "before_cursor_execute", lambda *args: seen.append(args[2]))
+    return seen
+
+
+@pytest.mark.parametrize("size", [1, 10, 100])
+def test_batch_statement_counts_do_not_grow_with_the_batch(dp, statements, size):
+    # Half of the IDs do not exist
+    book_ids = list(range(1, size + 1)) + [10_000 + i for i in range(size)]
+
+    counts = []
+    for operation in (book.add_books_to_library, book.add_books_to_library, book.remove_books_from_library):
+        statements.clear()
+        operation(dp, USER_ID, book_ids)
+        dp.commit()
+        counts.append(len(statements))
+
+    assert counts == [3, 2, 2]
+
+
+def test_batch_results_per_id(dp):
+    added = book.add_books_to_library(dp, USER_ID, [1, 2, 2, 999])
+    assert [r["status"] for r in added] == ["added", "added", "not_found"]
+
+    again = book.add_books_to_library(dp, USER_ID, [2, 3])
+    assert [r["status"] for r in again] == ["already_added", "added"]
+
+    removed = book.remove_books_from_library(dp, USER_ID, [1, 4])
+    assert [r["status"] for r in removed] == ["removed", "not_in_library"]
+    assert {b for (b,) in dp.query(models.UserBook.book_id)} == {2, 3}
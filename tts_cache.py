@@ -0,0 +1,258 @@
+from collections import OrderedDict
+from config import get_str, get_int
+import audio_index
+import threading
+import hashlib
+import asyncio
+import logging
+import shutil
+import wave
+import os
+
+logger = logging.getLogger(__name__)
+
+TTS_CACHE_DIR = get_str("TTS_CACHE_DIR", os.path.join("Cache", "tts"))
+TTS_CACHE_BUDGET_BYTES = get_int("TTS_CACHE_BUDGET_BYTES", 10 * 1024 ** 3)
+# Runs of uncached sentences are sent to the TTS service this many per request
+TTS_BATCH_SENTENCES = get_int("TTS_BATCH_SENTENCES", 200)
+
+
+def model_version(language):
+    return get_str(f"TTS_MODEL_VERSION_{language.name}", get_str("TTS_MODEL_VERSION", "1"))
+
+
+class SegmentCache:
+    """Content-addressed cache of synthesized sentence audio with LRU eviction.
+
+    Entries are WAV files named by the hash of (normalized text, language,
+    gender, model version) and fanned out by hash prefix. Recency is kept in
+    memory and mirrored to file mtimes so it survives restarts.
+    """
+
+    def __init__(self, root: str, budget_bytes: int):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+        self._index = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def key(text: str, language, gender: int):
+        raw = "\0".join([" ".join(text.split()), language.value, str(gender), model_version(language)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path(self, key: str):
+        return os.path.join(self.root, key[:2], key[2:4], f"{key}.wav")
+
+    def load(self):
+        """Scan the cache directory; blocking, so call it from a thread or at startup."""
+        with self._lock:
+            if self._index is None:
+                self._load()
+
+    def _load(self):
+        entries = []
+        if os.path.isdir(self.root):
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    if filename.endswith(".wav"):
+                        stat = os.stat(os.path.join(dirpath, filename))
+                        entries.append((stat.st_mtime, filename[:-4], stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((key, size) for _, key, size in entries)
+        self.total_bytes = sum(self._index.values())
+
+    @property
+    def index(self):
+        if self._index is None:
+            self.load()
+        return self._index
+
+    def get(self, key: str):
+        path = self.path(key)
+        with self._lock:
+            size = self.index.get(key)
+            if size is None or not os.path.exists(path):
+                self.index.pop(key, None)
+                self.misses += 1
+                return None
+
+            self.index.move_to_end(key)
+            os.utime(path)
+            self.hits += 1
+            self.bytes_saved += size
+        return path
+
+    def checkout(self, key: str, dest: str):
+        """Link (or copy) a cached segment to ``dest``; None on a miss.
+
+        The caller works on its own link, so eviction cannot remove a segment
+        it is about to stitch.
+        """
+        with self._lock:
+            path = self.get(key)
+            if path is None:
+                return None
+            try:
+                os.link(path, dest)
+            except OSError:
+                shutil.copyfile(path, dest)
+        return dest
+
+    def put(self, key: str, audio_path: str):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(audio_path, f"{path}.{threading.get_ident()}.tmp")
+        os.replace(f"{path}.{threading.get_ident()}.tmp", path)
+
+        size = os.path.getsize(path)
+        with self._lock:
+            self.total_bytes += size - self.index.get(key, 0)
+            self.index[key] = size
+            self.index.move_to_end(key)
+            self._evict()
+        return path
+
+    def _evict(self):
+        while self.total_bytes > self.budget_bytes and len(self.index) > 1:
+            key, size = self.index.popitem(last=False)
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            # Not loaded yet reads as empty rather than scanning on the event loop
+            "entries": len(self._index or ()),
+            "total_bytes": self.total_bytes,
+            "budget_bytes": self.budget_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions
+        }
+
+
+segment_cache = SegmentCache(TTS_CACHE_DIR, TTS_CACHE_BUDGET_BYTES)
+
+
+def stitch_wav(segment_paths, output_path: str):
+    """Concatenate WAV segments and return the starting frame of each one."""
+    start_frames = []
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with wave.open(tmp_path, "wb") as out:
+        params = None
+        for segment_path in segment_paths:
+            with wave.open(segment_path, "rb") as segment:
+                if params is None:
+                    params = segment.getparams()
+                    out.setparams(params)
+                elif segment.getparams()[:3] != params[:3]:
+                    raise ValueError(f"Segment {segment_path} has a different audio format")
+                start_frames.append(out.getnframes())
+                out.writeframes(segment.readframes(segment.getnframes()))
+    os.replace(tmp_path, output_path)
+    return start_frames
+
+
+def runs_of(indices, sentences):
+    """Split consecutive sentence indices into runs for one TTS request each.
+
+    A run ends at a gap, after TTS_BATCH_SENTENCES sentences, and before a
+    chapter heading, so every heading starts a segment with a known offset.
+    """
+    runs = []
+    for i in indices:
+        if (runs and runs[-1][-1] == i - 1 and len(runs[-1]) < TTS_BATCH_SENTENCES
+                and not audio_index.CHAPTER_HEADING.match(sentences[i])):
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    return runs
+
+
+def checkout_all(keys, work_dir: str):
+    return [segment_cache.checkout(key, os.path.join(work_dir, f"hit-{i}.wav")) for i, key in enumerate(keys)]
+
+
+def write_text(path: str, texts):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(text + "\n" for text in texts))
+
+
+async def synthesize(txt_path: str, output_path: str, language, gender: int, synthesize_text, on_progress=None):
+    """Narrate a sentence-per-line text file, reusing cached sentences.
+
+    ``synthesize_text(txt_path, audio_path)`` must narrate a sentence-per-line
+    text file into one WAV. Uncached sentences go out as runs of consecutive
+    lines, one request per run. Only audio known to hold exactly one sentence
+    is cached: a run of a single line, or a line that occurs more than once in
+    the book and is therefore synthesized on its own. Cached and new segments
+    are stitched into ``output_path``; ``on_progress(done, total)`` is called
+    after every request. Returns (sentence, start frame) pairs for the
+    sentences that start a segment, which include every chapter heading.
+    """
+    with open(txt_path, encoding="utf-8") as f:
+        sentences = [line.strip() for line in f if line.strip()]
+
+    work_dir = f"{output_path}.segments"
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        await asyncio.to_thread(segment_cache.load)
+        keys = [segment_cache.key(sentence, language, gender) for sentence in sentences]
+        cached = await asyncio.to_thread(checkout_all, keys, work_dir)
+
+        # Repeated lines are worth a request of their own: they become cacheable
+        counts = {}
+        for key, path in zip(keys, cached):
+            if path is None:
+                counts[key] = counts.get(key, 0) + 1
+        repeated = {key: None for key, count in counts.items() if count > 1}
+        missing = [i for i, path in enumerate(cached) if path is None and keys[i] not in repeated]
+
+        done = len(sentences) - len(missing) - sum(counts[key] for key in repeated)
+        if on_progress:
+            on_progress(done, len(sentences))
+
+        for key in repeated:
+            i = keys.index(key)
+            audio = os.path.join(work_dir, f"line-{i}.wav")
+            await asyncio.to_thread(write_text, f"{audio}.txt", [sentences[i]])
+            await synthesize_text(f"{audio}.txt", audio)
+            await asyncio.to_thread(segment_cache.put, key, audio)
+            repeated[key] = audio
+            done += counts[key]
+            if on_progress:
+                on_progress(done, len(sentences))
+
+        # (first sentence index, audio path) for every piece of the output
+        segments = [(i, path if path else repeated[keys[i]]) for i, path in enumerate(cached)
+                    if path or keys[i] in repeated]
+        for run in runs_of(missing, sentences):
+            audio = os.path.join(work_dir, f"run-{run[0]}.wav")
+            await asyncio.to_thread(write_text, f"{audio}.txt", [sentences[i] for i in run])
+            await synthesize_text(f"{audio}.txt", audio)
+            if len(run) == 1:
+                await asyncio.to_thread(segment_cache.put, keys[run[0]], audio)
+            segments.append((run[0], audio))
+            done += len(run)
+            if on_progress:
+                on_progress(done, len(sentences))
+
+        segments.sort()
+        start_frames = await asyncio.to_thread(stitch_wav, [path for _, path in segments], output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    logger.info("Synthesized %s: %s", output_path, segment_cache.stats())
+    return [(sentences[i], start_frame) for (i, _), start_frame in zip(segments, start_frames)]
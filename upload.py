@@ -1,37 +1,65 @@
-from dotenv import dotenv_values
+from config import config_credentials, get_str
 import models
-from fastapi import HTTPException, APIRouter, UploadFile, Depends, status, BackgroundTasks
+from fastapi import HTTPException, APIRouter, UploadFile, Depends, status, BackgroundTasks, Request
 import os
-from typing import Annotated
+from typing import Annotated, List
 from sqlalchemy.orm import Session
-from database import SessionLocal
-from auth import get_current_user
-from models import Language
+from database import SessionLocal, replicas
+from auth import get_current_user, get_read_db
+from models import Language, ArtifactState, ItemKind
 from sqlalchemy.exc import SQLAlchemyError
 import httpx
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
+import caching
+import schemas
+import admission
+import circuit
+import extraction
+import tts_cache
+import asyncio
+from storage import storage, artifact_key
+from eviction import evictor
+import audio_index
+import voices
+import artifacts
+import logging
+import threading
+import time
+from collections import OrderedDict
 
 router = APIRouter(
     prefix='/upload',
     tags=['Upload']
 )
 
-config_credentials = dotenv_values(".env")
+logger = logging.getLogger(__name__)
+
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 SERVICE_ACCOUNT_FILE = config_credentials["SERVICE_ACCOUNT_FILE"]
 PARENT_FOLDER_ID = config_credentials["PARENT_FOLDER_ID"]
 
 
-def authenticate():
-    creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE,
-                                                                  scopes=SCOPES)
-    return creds
+_drive_service = None
+# The client's httplib2 transport is not thread-safe: every call through it holds this lock
+_drive_lock = threading.RLock()
+
+
+def get_drive_service():
+    """Build the Drive client on first use; googleapiclient is slow to import and build."""
+    global _drive_service
+    if _drive_service is None:
+        with _drive_lock:
+            if _drive_service is None:
+                from googleapiclient.discovery import build
+                from google.oauth2 import service_account
+
+                creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE,
+                                                                              scopes=SCOPES)
+                _drive_service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+    return _drive_service
 
 
 def create_drive_folder(folder_name: str):
-    creds = authenticate()
-    service = build('drive', 'v3', credentials=creds)
+    service = get_drive_service()
 
     file_metadata = {
         "name": folder_name,
@@ -39,28 +67,29 @@ def create_drive_folder(folder_name: str):
         "parents": [PARENT_FOLDER_ID]
     }
 
-    folder = service.files().create(
-        body=file_metadata,
-        fields="id, webViewLink"
-    ).execute()
+    with _drive_lock:
+        folder = service.files().create(
+            body=file_metadata,
+            fields="id, webViewLink"
+        ).execute()
 
     return folder["id"], folder["webViewLink"]
 
 
 def upload_file_to_drive(path: str, name: str, folder_id: str):
-    creds = authenticate()
-    service = build('drive', 'v3', credentials=creds)
+    service = get_drive_service()
 
     file_metadata = {
         "name": name,
         "parents": [folder_id]
     }
 
-    file = service.files().create(
-        body=file_metadata,
-        media_body=path,
-        fields="id"
-    ).execute()
+    with _drive_lock:
+        file = service.files().create(
+            body=file_metadata,
+            media_body=path,
+            fields="id"
+        ).execute()
 
     return file["id"]
 
@@ -74,33 +103,31 @@ def get_db():
 
 
 dp_dependency = Annotated[Session, Depends(get_db)]
+read_dp_dependency = Annotated[Session, Depends(get_read_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
 
-@router.post("/upload_file/{file_language}")
+@router.post("/upload_file/{file_language}", response_model=schemas.Message)
 async def upload_file(file: UploadFile, file_language: str, dp: dp_dependency,
                       user: user_dependency, background_tasks: BackgroundTasks):
-    path = os.path.join("Uploads", file.filename)
-    print(path)
-    os.makedirs(path, exist_ok=True)
+    started = time.monotonic()
+    # Reserve TTS capacity for the three narrations before doing any work
+    ticket = admission.tts.admit(user["id"], jobs=3)
 
-    file_path = os.path.join(path, "book_text.pdf")
-    print(file_path)
     try:
-        contents = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(contents)
+        # Stored under its content hash, so same-named uploads never collide; scoped to
+        # the user so deleting an upload cannot remove another user's copy
+        text_key, content_hash = await asyncio.to_thread(storage.save_stream, file.file, "book_text.pdf",
+                                                         user["id"])
 
-        folder_id, folder_link = create_drive_folder(file.filename)
-        file_link = upload_file_to_drive(file_path, "book_text.pdf", folder_id)
+        folder_id, folder_link = await asyncio.to_thread(create_drive_folder, file.filename)
+        text_path = await asyncio.to_thread(storage.fetch, text_key)
+        file_link = await asyncio.to_thread(upload_file_to_drive, text_path, "book_text.pdf", folder_id)
 
         book = models.Upload(
             user_id=user["id"],
             title=file.filename,
-            male_audio=os.path.join(path, 'male.wav'),
-            female_audio=os.path.join(path, 'female.wav'),
-            child_audio=os.path.join(path, 'child.wav'),
-            text=file_path,
+            text=text_key,
             text_id=file_link,
             language=Language.from_str(file_language),
             drive_folder_link=folder_link,
@@ -108,31 +135,227 @@ async def upload_file(file: UploadFile, file_language: str, dp: dp_dependency,
 
         )
         dp.add(book)
+        dp.flush()
+        book.male_audio = artifact_key("upload", book.id, "male.wav")
+        book.female_audio = artifact_key("upload", book.id, "female.wav")
+        book.child_audio = artifact_key("upload", book.id, "child.wav")
         dp.commit()
+        replicas.mark_write(user["id"])
+        for variant in artifacts.BASE_VARIANTS:
+            artifacts.start(ItemKind.UPLOAD, book.id, variant)
 
-
-        background_tasks.add_task(send_tts_request, book, book.female_audio, 1)
-        background_tasks.add_task(send_tts_request, book, book.male_audio, 0)
-        background_tasks.add_task(send_tts_request, book, book.child_audio, 2)
+        background_tasks.add_task(synthesize_upload, book, content_hash, ticket, started)
 
 
     except SQLAlchemyError as e:
         dp.rollback()
+        ticket.cancel()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
     except Exception as e:
         dp.rollback()
+        ticket.cancel()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
     return {"message": "File uploaded successfully"}
 
 
-async def send_tts_request(book: models.Upload, output_path: str, gender: int):
+GENDERS = {1: "female", 0: "male", 2: "child"}
+TTS_BATCH_URLS = {
+    models.Language.ENGLISH: get_str("TTS_BATCH_URL"),
+    models.Language.ARABIC: get_str("TTS_ARABIC_BATCH_URL"),
+    models.Language.DIACRITIZED_ARABIC: get_str("TTS_ARABIC_BATCH_URL")
+}
+
+
+class SynthesisTracker:
+    """Per-gender narration progress of recent uploads, and upload-to-ready timings."""
+
+    def __init__(self, keep: int = 1000):
+        self.keep = keep
+        self._uploads = OrderedDict()
+        self.completed = 0
+        self.batched = 0
+        self.total_seconds = 0.0
+        self.last_seconds = None
+
+    def start(self, upload_id: int, user_id: int, started: float, batched: bool):
+        self._uploads[upload_id] = {
+            "user_id": user_id,
+            "started": started,
+            "batched": batched,
+            "voices": {name: {"state": "Queued", "done": 0, "total": None} for name in GENDERS.values()}
+        }
+        while len(self._uploads) > self.keep:
+            self._uploads.popitem(last=False)
+
+    def update(self, upload_id: int, gender: int, state: str = None, done: int = None, total: int = None):
+        entry = self._uploads.get(upload_id)
+        if entry is None:
+            return
+        voice = entry["voices"][GENDERS[gender]]
+        if state is not None:
+            voice["state"] = state
+        if done is not None:
+            voice["done"] = done
+        if total is not None:
+            voice["total"] = total
+
+    def finish(self, upload_id: int):
+        entry = self._uploads.get(upload_id)
+        if entry is None:
+            return
+        seconds = time.monotonic() - entry["started"]
+        entry["seconds"] = seconds
+        self.completed += 1
+        self.batched += entry["batched"]
+        self.total_seconds += seconds
+        self.last_seconds = seconds
+        logger.info("Upload %s narrated in %.1fs (%s)", upload_id, seconds,
+                    "batched" if entry["batched"] else "concurrent")
+
+    def get(self, upload_id: int, user_id: int):
+        """Progress of an upload, or None unless ``user_id`` owns it."""
+        entry = self._uploads.get(upload_id)
+        if entry is None or entry["user_id"] != user_id:
+            return None
+        return {
+            "upload_id": upload_id,
+            "batched": entry["batched"],
+            "seconds": round(entry.get("seconds", time.monotonic() - entry["started"]), 1),
+            "voices": [{"gender": name, **voice} for name, voice in entry["voices"].items()]
+        }
+
+    def stats(self):
+        return {
+            "completed": self.completed,
+            "batched": self.batched,
+            "avg_seconds": round(self.total_seconds / self.completed, 1) if self.completed else None,
+            "last_seconds": round(self.last_seconds, 1) if self.last_seconds is not None else None
+        }
+
+
+tracker = SynthesisTracker()
+
+
+async def synthesize_upload(book: models.Upload, content_hash: str, ticket: admission.Ticket, started: float):
+    """Extract the upload's text once, then narrate it in all three genders.
+
+    Uses one batched TTS job when the backend offers it, so the text is only
+    preprocessed once; otherwise the three genders are synthesized concurrently.
+    """
+    batch_url = TTS_BATCH_URLS.get(book.language)
+    tracker.start(book.id, book.user_id, started, batched=bool(batch_url))
+    try:
+        try:
+            pdf_path = await asyncio.to_thread(storage.fetch, book.text)
+            txt_path = await extraction.extract_text(pdf_path, book.language, content_hash)
+        except Exception:
+            # Fall back to letting the TTS service read the PDF itself
+            logger.exception("Text extraction failed for upload %s", book.id)
+            txt_path = None
+
+        outputs = [(book.female_audio, 1), (book.male_audio, 0), (book.child_audio, 2)]
+        if batch_url:
+            try:
+                await synthesize_batch(book, outputs, txt_path, batch_url, ticket)
+                return
+            except Exception as e:
+                # Retry whatever the batch did not produce one gender at a time
+                logger.error("Batched TTS failed for upload %s: %s", book.id, getattr(e, "detail", e))
+                produced = await asyncio.gather(*(asyncio.to_thread(storage.exists, key) for key, _ in outputs))
+                outputs = [output for output, exists in zip(outputs, produced) if not exists]
+                if not outputs:
+                    return
+                try:
+                    ticket = admission.tts.admit(jobs=len(outputs))
+                except HTTPException as e:
+                    for _, gender in outputs:
+                        tracker.update(book.id, gender, state="Failed")
+                    logger.error("Cannot retry TTS for upload %s: %s", book.id, e.detail)
+                    return
+                for _, gender in outputs:
+                    artifacts.start(ItemKind.UPLOAD, book.id, audio_index.base_variant(gender))
+
+        await asyncio.gather(*(synthesize_gender(book, key, gender, txt_path, ticket) for key, gender in outputs))
+    finally:
+        # Give back any admitted job that never ran, whatever went wrong
+        ticket.cancel()
+        tracker.finish(book.id)
+
+
+async def synthesize_batch(book: models.Upload, outputs, txt_path: str, batch_url: str, ticket: admission.Ticket):
+    for _, gender in outputs:
+        tracker.update(book.id, gender, state="Processing")
+        artifacts.advance(ItemKind.UPLOAD, book.id, audio_index.base_variant(gender), ArtifactState.PROCESSING)
+    try:
+        await ticket.run_batch(len(outputs), send_tts_batch_request, book, batch_url,
+                               [storage.path_for(key) for key, _ in outputs],
+                               [gender for _, gender in outputs], txt_path)
+    except BaseException as e:
+        for _, gender in outputs:
+            artifacts.fail(ItemKind.UPLOAD, book.id, audio_index.base_variant(gender), getattr(e, "detail", e))
+        raise
+    missing = []
+    for output_key, gender in outputs:
+        if not os.path.exists(storage.path_for(output_key)):
+            missing.append(GENDERS[gender])
+            artifacts.fail(ItemKind.UPLOAD, book.id, audio_index.base_variant(gender), "Batched TTS produced no audio")
+            continue
+        await asyncio.to_thread(storage.commit, output_key)
+        artifacts.ready(ItemKind.UPLOAD, book.id, audio_index.base_variant(gender), output_key)
+        await asyncio.to_thread(audio_index.index_audio, models.ItemKind.UPLOAD, book.id,
+                                audio_index.base_variant(gender), output_key)
+        tracker.update(book.id, gender, state="Ready")
+    if missing:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY,
+                            detail=f"Batched TTS produced no {', '.join(missing)} narration")
+
+
+async def synthesize_gender(book: models.Upload, output_key: str, gender: int, txt_path: str,
+                            ticket: admission.Ticket):
+    output_path = storage.path_for(output_key)
+    variant = audio_index.base_variant(gender)
+    tracker.update(book.id, gender, state="Processing")
+    try:
+        with artifacts.tracking(ItemKind.UPLOAD, book.id, variant):
+            segments = None
+            if txt_path:
+                segments = await ticket.run(synthesize_cached, book, output_path, gender, txt_path)
+            else:
+                await ticket.run(send_tts_request, book, output_path, gender)
+            await asyncio.to_thread(storage.commit, output_key)
+            artifacts.ready(ItemKind.UPLOAD, book.id, variant, output_key)
+        await asyncio.to_thread(audio_index.index_audio, models.ItemKind.UPLOAD, book.id,
+                                variant, output_key, segments)
+        tracker.update(book.id, gender, state="Ready")
+    except HTTPException as e:
+        tracker.update(book.id, gender, state="Failed")
+        logger.error("TTS failed for upload %s, gender %s: %s", book.id, gender, e.detail)
+    except Exception:
+        # e.g. wave.Error or OSError while stitching; the other genders carry on
+        tracker.update(book.id, gender, state="Failed")
+        logger.exception("TTS failed for upload %s, gender %s", book.id, gender)
+
+
+async def synthesize_cached(book: models.Upload, output_path: str, gender: int, txt_path: str):
+    async def synthesize_text(segment_txt_path: str, segment_audio_path: str):
+        await send_tts_request(book, segment_audio_path, gender, segment_txt_path)
+
+    def on_progress(done: int, total: int):
+        tracker.update(book.id, gender, done=done, total=total)
+
+    return await tts_cache.synthesize(txt_path, output_path, book.language, gender, synthesize_text,
+                                      on_progress=on_progress)
+
+
+async def send_tts_request(book: models.Upload, output_path: str, gender: int, txt_path: str = None):
+    txt_path = txt_path or await asyncio.to_thread(storage.fetch, book.text)
     url = ""
     data = {}
     if book.language == models.Language.ENGLISH:
         url = "http://127.0.0.3:8000/TTS/"
         data = {
-            "txt_path": book.text,
+            "txt_path": txt_path,
             "output_path": output_path,
             "gender": gender,
             "upload_id": book.id
@@ -143,7 +366,7 @@ async def send_tts_request(book: models.Upload, output_path: str, gender: int):
             diacritics = False
         url = "http://127.0.0.4:8000/TTSArabic/"
         data = {
-            "txt_path": book.text,
+            "txt_path": txt_path,
             "output_path": output_path,
             "gender": gender,
             "diacritics": diacritics,
@@ -151,12 +374,10 @@ async def send_tts_request(book: models.Upload, output_path: str, gender: int):
         }
 
     try:
+        return await circuit.post(circuit.tts_for(book.language), url, data)
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, params=data, timeout=300)
-        response.raise_for_status()
-        return response
-
+    except circuit.CircuitOpenError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
     except httpx.HTTPStatusError as e:
         raise HTTPException(status_code=e.response.status_code, detail=f"TTS service error: {e.response.text}")
     except httpx.RequestError as e:
@@ -166,31 +387,63 @@ async def send_tts_request(book: models.Upload, output_path: str, gender: int):
         raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="TTS service request timed out")
 
 
-@router.get("/get_my_uploads", response_model=list)
-async def get_my_uploads(dp: dp_dependency, user: user_dependency):
+async def send_tts_batch_request(book: models.Upload, url: str, output_paths: List[str], genders: List[int],
+                                 txt_path: str = None):
+    """Ask the TTS service for several genders in one job so the text is preprocessed once."""
+    data = {
+        "txt_path": txt_path or await asyncio.to_thread(storage.fetch, book.text),
+        "output_paths": ",".join(output_paths),
+        "genders": ",".join(str(gender) for gender in genders),
+        "upload_id": book.id
+    }
+    if book.language != models.Language.ENGLISH:
+        data["diacritics"] = book.language != models.Language.DIACRITIZED_ARABIC
+
+    try:
+        return await circuit.post(circuit.tts_for(book.language), url, data)
+
+    except circuit.CircuitOpenError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail=f"TTS service error: {e.response.text}")
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=f"Unable to connect to TTS service: {e}")
+
+
+@router.get("/tts_progress/{upload_id}", response_model=schemas.SynthesisProgress)
+async def get_tts_progress(upload_id: int, user: user_dependency):
+    progress = tracker.get(upload_id, user["id"])
+    if progress is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No narration in progress for this upload")
+    return progress
+
+
+@router.get("/get_my_uploads", response_model=List[schemas.MyUpload])
+async def get_my_uploads(dp: read_dp_dependency, user: user_dependency, request: Request):
     try:
-        # Query the database to retrieve books where my_books is True
-        user_uploads = dp.query(models.Upload).filter(models.Upload.user_id == user["id"]).all()
-
-        # Construct a list of dictionaries with the desired information
-        my_uploads_info_list = []
-        for user_upload in user_uploads:
-            book_info = {
-                "id": user_upload.id,
-                "title": user_upload.title,
-                "text": user_upload.text_id,
-                "cover_photo": user_upload.cover_photo
-            }
-            my_uploads_info_list.append(book_info)
-
-        print(my_uploads_info_list)
-
-        return my_uploads_info_list
+        etag = caching.make_etag(
+            "my_uploads", user["id"],
+            caching.table_version(dp, models.Upload.updated_at, models.Upload.user_id == user["id"])
+        )
+        cached = caching.not_modified(request, etag)
+        if cached:
+            return cached
+
+        # Query the database to retrieve the user's uploads
+        user_uploads = dp.query(
+            models.Upload.id,
+            models.Upload.title,
+            models.Upload.text_id.label("text"),
+            models.Upload.cover_photo
+        ).filter(models.Upload.user_id == user["id"]).all()
+
+        return schemas.rows_response(user_uploads, headers={"ETag": etag})
     except SQLAlchemyError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
 
 
-@router.post("/delete_upload/{upload_id}")
+@router.post("/delete_upload/{upload_id}", response_model=schemas.Message)
 async def delete_upload(upload_id: int, dp: dp_dependency, user: user_dependency):
     try:
         upload_voice_statuses = dp.query(models.UploadVoiceStatus).filter(
@@ -205,6 +458,11 @@ async def delete_upload(upload_id: int, dp: dp_dependency, user: user_dependency
         for upload_voice in upload_voices:
             dp.delete(upload_voice)
 
+        dp.query(models.Artifact).filter(
+            models.Artifact.owner_kind == ItemKind.UPLOAD,
+            models.Artifact.owner_id == upload_id
+        ).delete(synchronize_session=False)
+
         user_upload = dp.query(models.Upload).filter(
             models.Upload.user_id == user["id"],
             models.Upload.id == upload_id
@@ -214,8 +472,14 @@ async def delete_upload(upload_id: int, dp: dp_dependency, user: user_dependency
         if not user_upload:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
 
+        text_key = user_upload.text
         dp.delete(user_upload)
         dp.commit()
+        replicas.mark_write(user["id"])
+
+        # The same user's uploads of one PDF share its stored copy
+        if text_key and not dp.query(models.Upload.id).filter(models.Upload.text == text_key).first():
+            await asyncio.to_thread(storage.delete, text_key)
 
         return {"message": "Book removed Successfully"}
     except SQLAlchemyError as e:
@@ -223,101 +487,125 @@ async def delete_upload(upload_id: int, dp: dp_dependency, user: user_dependency
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
 
 
-@router.get("/get_upload_voice/")
-async def get_upload_voice(book_id: int, voice_id: int, dp: dp_dependency):
+@router.get("/get_upload_voice/", response_model=schemas.VoiceAudio, response_model_exclude_none=True)
+async def get_upload_voice(book_id: int, voice_id: int, dp: dp_dependency, user: user_dependency):
+    variant = audio_index.voice_variant(voice_id)
     try:
-        upload = dp.query(models.Upload).filter(
-            models.Upload.id == book_id
-        ).first()
-
-        if not os.path.exists(upload.child_audio):
-            return {"message": "Can't get this audio now, try again in hour"}
-
-        if not os.path.exists(upload.female_audio):
-            return {"message": "Can't get this audio now, try again in hour"}
+        upload = dp.get(models.Upload, book_id)
+        if not upload or upload.user_id != user["id"]:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+
+        # Reads the primary: the answer decides whether to start a conversion
+        # Polling resolves with this and the ownership primary-key lookup until the voice is ready
+        artifact = artifacts.lookup(dp, ItemKind.UPLOAD, book_id, variant)
+
+        if artifact and artifact.state == ArtifactState.READY:
+            evictor.touch("upload", book_id, voice_id)
+            return {"audio": artifact.audio_id or legacy_audio_id(dp, book_id, voice_id) or artifact.audio,
+                    "url": await asyncio.to_thread(storage.url, artifact.audio)}
+
+        if artifacts.in_progress(artifact):
+            if circuit.voice_changer.is_open:
+                return {"message": circuit.UNAVAILABLE_MESSAGE}
+            return {"message": "Processing"}
 
-        if not os.path.exists(upload.male_audio):
+        # The three base narrations are started at upload time
+        if any(state != ArtifactState.READY for state in artifacts.base_states(dp, ItemKind.UPLOAD, book_id).values()):
+            if circuit.tts_for(upload.language).is_open:
+                return {"message": circuit.UNAVAILABLE_MESSAGE}
             return {"message": "Can't get this audio now, try again in hour"}
 
+        if circuit.voice_changer.is_open:
+            return {"message": circuit.UNAVAILABLE_MESSAGE}
 
-        upload_voice_status = dp.query(models.UploadVoiceStatus).filter(
-            models.UploadVoiceStatus.upload_id == book_id,
-            models.UploadVoiceStatus.voice_id == voice_id
-        ).first()
-
-        if not upload_voice_status:
-            upload = dp.query(models.Upload).filter(
-                models.Upload.id == book_id
-            ).first()
+        out_key = artifact_key("upload", book_id, f"voice_{voice_id}.wav")
+        ticket = admission.voice_changer.admit(upload.user_id)
+        if not artifacts.start(ItemKind.UPLOAD, book_id, variant):
+            ticket.cancel()
+            return {"message": "Processing"}
 
-            voice = dp.query(models.Voice).filter(
-                models.Voice.id == voice_id
-            ).first()
+        await ticket.run(generate_upload_voice, book_id, voice_id, out_key, dp)
 
-            # processing
-            path = os.path.join(r"D:\Backend\ShahrZad\Uploads", upload.title, f"{voice.name}.wav")
+        return {"message": "Processing"}
 
-            await generate_upload_voice(book_id, voice_id, path, dp)
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
 
-            return {"message": "Processing"}
 
-        if not upload_voice_status.status:
-            return {"message": "Processing"}
+def legacy_audio_id(dp: Session, upload_id: int, voice_id: int):
+    """Drive file id the voice changer wrote to ``upload_voices``, if any."""
+    return dp.query(models.UploadVoice.audio_id).filter(
+        models.UploadVoice.upload_id == upload_id,
+        models.UploadVoice.voice_id == voice_id
+    ).scalar()
 
-        upload_voice = dp.query(models.UploadVoice).filter(
-            models.UploadVoice.upload_id == book_id,
-            models.UploadVoice.voice_id == voice_id
-        ).first()
 
-        return {"audio": upload_voice.audio_id}
+@router.get("/get_upload_voices_status/{upload_id}", response_model=List[schemas.VoiceStatus])
+async def get_upload_voices_status(upload_id: int, dp: read_dp_dependency, user: user_dependency):
+    try:
+        owner = dp.query(models.Upload.user_id).filter(models.Upload.id == upload_id).first()
+        if not owner or owner.user_id != user["id"]:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
 
+        # Read-only: never triggers generation
+        return artifacts.voice_statuses(dp, ItemKind.UPLOAD, upload_id)
     except SQLAlchemyError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
 
 
-async def generate_upload_voice(upload_id: int, voice_id: int, out_path: str, dp: dp_dependency):
+async def generate_upload_voice(upload_id: int, voice_id: int, out_key: str, dp: dp_dependency):
+    with artifacts.tracking(ItemKind.UPLOAD, upload_id, audio_index.voice_variant(voice_id)):
+        await convert_upload_voice(upload_id, voice_id, out_key, dp)
+
+
+async def convert_upload_voice(upload_id: int, voice_id: int, out_key: str, dp: dp_dependency):
     try:
 
         upload = dp.query(models.Upload).filter(
             models.Upload.id == upload_id
         ).first()
 
-        voice = dp.query(models.Voice).filter(
-            models.Voice.id == voice_id
-        ).first()
-
-        configs = dp.query(models.VoicesConfigs).filter(
-            (models.VoicesConfigs.voice_id == voice_id)
-        ).first()
+        voice = voices.registry.get(voice_id)
+        if voice is None or voice.model_name is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Voice not found")
 
         audio = {
             "Male": upload.male_audio,
             "Female": upload.female_audio
         }.get(voice.gender, upload.child_audio)
+        audio = await asyncio.to_thread(storage.fetch, audio)
+        out_path = storage.path_for(out_key)
 
         data = {
             "input_path": audio,
             "output_path": out_path,
-            "transpose": configs.transpose,
-            "model_name": configs.model_name,
+            "transpose": voice.transpose,
+            "model_name": voice.model_name,
             "upload_id": upload_id,
             "voice_id": voice_id,
             "is_book": False
         }
-        print(audio)
-
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "http://127.0.0.2:8000/voice_changing/", params=data,
-                timeout=300
-            )
-            response.raise_for_status()
 
-        print(response)
+        await circuit.post(circuit.voice_changer, "http://127.0.0.2:8000/voice_changing/", data)
+        if not os.path.exists(out_path):
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY,
+                                detail="Voice changing service produced no audio")
+        await asyncio.to_thread(storage.commit, out_key)
+        # The voice changer records the Drive file id itself; end this session's
+        # snapshot so the row it just wrote is visible
+        dp.commit()
+        artifacts.ready(ItemKind.UPLOAD, upload_id, audio_index.voice_variant(voice_id), out_key,
+                        audio_id=legacy_audio_id(dp, upload_id, voice_id))
+        await asyncio.to_thread(audio_index.index_audio, models.ItemKind.UPLOAD, upload_id,
+                                audio_index.voice_variant(voice_id), out_key,
+                                base=audio_index.base_variant(voice.gender))
 
     except SQLAlchemyError as e:
         dp.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+    except circuit.CircuitOpenError as e:
+        dp.rollback()
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
     except httpx.HTTPStatusError as e:
         dp.rollback()
         raise HTTPException(status_code=e.response.status_code,
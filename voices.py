@@ -0,0 +1,122 @@
+from fastapi import HTTPException, APIRouter, Header, status
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+from sqlalchemy.exc import SQLAlchemyError
+from database import SessionLocal
+from config import get_str, get_float
+import models
+import caching
+import schemas
+import asyncio
+import hmac
+import orjson
+import logging
+
+router = APIRouter(
+    prefix='/voices',
+    tags=['Voices']
+)
+
+logger = logging.getLogger(__name__)
+
+VOICE_REGISTRY_POLL_SECONDS = get_float("VOICE_REGISTRY_POLL_SECONDS", 60)
+ADMIN_TOKEN = get_str("ADMIN_TOKEN")
+
+
+class VoiceEntry(NamedTuple):
+    id: int
+    name: str
+    photo: Optional[str]
+    gender: str
+    audio: Optional[str]
+    transpose: Optional[int]
+    model_name: Optional[str]
+
+
+class Snapshot(NamedTuple):
+    version: Optional[str]
+    etag: str
+    voices: MappingProxyType
+    listing: bytes
+
+
+def load_version(dp):
+    return "|".join((
+        caching.table_version(dp, models.Voice.updated_at),
+        caching.table_version(dp, models.VoicesConfigs.updated_at)
+    ))
+
+
+class VoiceRegistry:
+    """Every voice joined with its conversion config, held in memory.
+
+    A snapshot is never modified: a reload builds a new one and swaps the
+    reference, so readers always see one consistent roster without locking.
+    """
+
+    def __init__(self):
+        self.snapshot = Snapshot(None, caching.make_etag("voices", None), MappingProxyType({}), b"[]")
+        self.reloads = 0
+
+    def get(self, voice_id: int):
+        return self.snapshot.voices.get(voice_id)
+
+    def reload(self):
+        """Load the roster from the database if it changed; returns True when swapped."""
+        dp = SessionLocal()
+        try:
+            version = load_version(dp)
+            if version == self.snapshot.version:
+                return False
+            rows = dp.query(
+                models.Voice.id,
+                models.Voice.name,
+                models.Voice.photo,
+                models.Voice.gender,
+                models.Voice.audio,
+                models.VoicesConfigs.transpose,
+                models.VoicesConfigs.model_name
+            ).outerjoin(
+                models.VoicesConfigs, models.VoicesConfigs.voice_id == models.Voice.id
+            ).order_by(models.Voice.id).all()
+        finally:
+            dp.close()
+
+        voices = {row.id: VoiceEntry(*row) for row in rows}
+        listing = orjson.dumps([
+            {"id": v.id, "name": v.name, "photo": v.photo, "gender": v.gender, "audio": v.audio}
+            for v in voices.values()
+        ])
+        self.snapshot = Snapshot(version, caching.make_etag("voices", version), MappingProxyType(voices), listing)
+        self.reloads += 1
+        logger.info("Loaded %d voices (version %s)", len(voices), version)
+        return True
+
+    async def run(self, interval: float = VOICE_REGISTRY_POLL_SECONDS):
+        while True:
+            try:
+                await asyncio.to_thread(self.reload)
+            except SQLAlchemyError:
+                # Keep serving the last snapshot until the database is back
+                logger.exception("Voice registry reload failed")
+            await asyncio.sleep(interval)
+
+
+registry = VoiceRegistry()
+
+
+@router.post("/reload", response_model=schemas.Message)
+async def reload_voices(x_admin_token: str = Header(default="")):
+    """Reload the worker that receives this request.
+
+    Other workers are not signalled: each one sees the changed version stamp on
+    its next poll, so the whole fleet is current within VOICE_REGISTRY_POLL_SECONDS.
+    """
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
+    try:
+        swapped = await asyncio.to_thread(registry.reload)
+    except SQLAlchemyError:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+    return {"message": (f"Voices reloaded on this worker; other workers follow within "
+                        f"{VOICE_REGISTRY_POLL_SECONDS:g}s") if swapped else "Voices unchanged"}